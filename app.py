@@ -1,19 +1,47 @@
 import os
 import re
+import io
+import csv
+import bisect
 import uvicorn
 import smtplib
-import random
-from datetime import datetime, timedelta
-from json import dumps as json_dumps
+import time
+import hmac
+import asyncio
+import base64
+import hashlib
+import secrets
+import cProfile
+import pstats
+import threading
+import signal
+import argparse
+import zlib
+from collections import OrderedDict, Counter, deque
+from contextvars import ContextVar
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from json import dumps as json_dumps, loads as json_loads
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 from fastapi import FastAPI, Request, Depends, HTTPException, Response
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import create_engine, Column, Integer, String
-from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from starlette.datastructures import MutableHeaders
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import create_engine, event, Column, Integer, String, DateTime, ForeignKey, Index, inspect, text, or_, and_, select, func, delete, insert, update, union_all, literal, cast
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, make_transient_to_detached, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+try: import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+try: import brotli  # Tùy chọn: có thì nén br cho trình duyệt hỗ trợ, không thì chỉ gzip
+except ImportError: brotli = None
 
 # ============================================================
 # 1. CẤU HÌNH HỆ THỐNG & EMAIL
@@ -21,10 +49,107 @@ from sqlalchemy.orm import sessionmaker, declarative_base, Session
 SENDER_EMAIL = os.getenv("SENDER_EMAIL", "thengudot1233@gmail.com")
 # Mật khẩu: Ưu tiên lấy từ Env (Render), nếu không có thì lấy chuỗi mặc định (Local)
 SENDER_PASSWORD = os.getenv("SENDER_PASSWORD", "sabr awjk ssqo dblh") 
+# Máy chủ SMTP: mặc định Gmail SSL 465; đặt SMTP_HOST=localhost SMTP_PORT=1025 SMTP_SSL=0 để test với aiosmtpd
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("SMTP_SSL", "1") == "1"
+MAIL_WORKERS = int(os.getenv("MAIL_WORKERS", "1"))
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./database.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Khóa ký phiên đăng nhập: chạy nhiều worker/nhiều máy thì phải đặt SESSION_SECRET giống nhau
+SESSION_SECRET = os.getenv("SESSION_SECRET") or secrets.token_hex(32)
+SESSION_COOKIE = "session"
+SESSION_MAX_AGE = 7 * 24 * 3600
+
+# CSDL: mặc định SQLite file; đặt DATABASE_URL=postgresql://... để dùng PostgreSQL (cần psycopg2)
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")
+if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):  # Render/Heroku dùng scheme cũ
+    SQLALCHEMY_DATABASE_URL = "postgresql://" + SQLALCHEMY_DATABASE_URL[len("postgres://"):]
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Sự kiện lịch đặt realtime: mặc định chỉ trong 1 tiến trình; chạy nhiều worker thì đặt BOOKING_EVENTS_URL=redis://... (cần gói redis)
+BOOKING_EVENTS_URL = os.getenv("BOOKING_EVENTS_URL", "")
+# Cache User theo id: có BOOKING_EVENTS_URL thì đổi/xóa user báo cho mọi worker xóa cache ngay. Không có thì chỉ worker
+# xử lý request xóa được, worker khác giữ bản cũ (vd. quyền admin vừa bị hạ) tối đa USER_CACHE_TTL giây -> để TTL ngắn
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60" if BOOKING_EVENTS_URL else "5"))
+# Mã OTP: mặc định lưu ở bảng auth_kv nên mọi worker đều thấy; bộ đếm giới hạn tần suất mặc định tính riêng từng worker.
+# Đặt AUTH_STORE_URL=redis://... để cả 2 dùng chung qua Redis
+AUTH_STORE_URL = os.getenv("AUTH_STORE_URL", "")
+OTP_TTL = int(os.getenv("OTP_TTL", "300"))
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT", "1") == "1"  # Đặt RATE_LIMIT=0 khi chạy benchmark tải
+# Chỉ mục phòng trống được nạp lại toàn bộ sau ngần này giây (lưới an toàn khi nhiều worker dùng backend sự kiện cục bộ)
+AVAILABILITY_INDEX_TTL = float(os.getenv("AVAILABILITY_INDEX_TTL", "300"))
+# Số liệu dashboard được nạp lại từ DB sau ngần này giây, giữa các lần nạp thì cập nhật theo sự kiện
+DASHBOARD_STATS_TTL = float(os.getenv("DASHBOARD_STATS_TTL", "60"))
+
+# Lưu trữ: lịch kết thúc quá ARCHIVE_AFTER_HOURS giờ được chuyển sang bookings_archive, job chạy mỗi ARCHIVE_INTERVAL giây (0 = tắt)
+# Chỉ nên giảm ARCHIVE_AFTER_HOURS: tăng lên thì lịch đã lưu trữ nằm sau mốc mới sẽ không được đọc khi xem khung giờ gần
+ARCHIVE_AFTER_HOURS = float(os.getenv("ARCHIVE_AFTER_HOURS", "24"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+# Xuất dữ liệu/báo cáo: số dòng lấy từ DB mỗi lượt khi stream; báo cáo công suất được cache theo kỳ ngần này giây
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+REPORT_CACHE_TTL = float(os.getenv("REPORT_CACHE_TTL", "600"))
+# Số giờ phòng mở cửa mỗi ngày (07:00 - 21:00), làm mẫu số khi tính tỉ lệ sử dụng
+UTILIZATION_DAY_HOURS = float(os.getenv("UTILIZATION_DAY_HOURS", "14"))
+
+# Khởi động production (python app.py serve): tạo bảng + seed đúng 1 lần dưới khóa, tắt thì chờ request đang chạy tối đa ngần này giây
+INIT_LOCK_FILE = os.getenv("INIT_LOCK_FILE", "./.edumanager-init.lock")
+INIT_LOCK_KEY = 74210001  # Khóa advisory của PostgreSQL khi nhiều máy cùng khởi động
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+# Giám sát: 1 request chạy cùng 1 câu SQL quá ngần này lần thì cảnh báo N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+# Profile 1 request trên production: gửi header X-Profile: <PROFILE_TOKEN>. Để trống = tắt
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+
+# Trả trang: response nhỏ hơn COMPRESS_MIN_SIZE byte thì không nén; template biên dịch sẵn lưu ở JINJA_CACHE_DIR (để trống = tắt)
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", "./.jinja-cache")
+STATIC_DIR = "static"
+
+# Driver async tương ứng cho request handler (aiosqlite / asyncpg)
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+def async_database_url(url):
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)}://{rest}"
+
+def create_db_engine(url, factory=create_engine):
+    if url.startswith("sqlite"):
+        connect_args = {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        if factory is create_engine: connect_args["check_same_thread"] = False
+        # Chỉ định pool rõ ràng: SQLAlchemy < 2.0.38 mặc định NullPool cho aiosqlite, không nhận pool_size/max_overflow
+        poolclass = QueuePool if factory is create_engine else AsyncAdaptedQueuePool
+        sqlite_engine = factory(url, connect_args=connect_args, poolclass=poolclass, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+        # WAL: đọc không bị chặn bởi ghi; NORMAL đủ an toàn với WAL và giảm fsync
+        @event.listens_for(getattr(sqlite_engine, "sync_engine", sqlite_engine), "connect")
+        def _set_sqlite_pragmas(dbapi_conn, conn_record):
+            cursor = dbapi_conn.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.close()
+
+        return sqlite_engine
+    return factory(
+        url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True, pool_recycle=1800,
+    )
+
+class AppSession(Session):
+    """Session dùng chung cho cả 2 đường: sự kiện gắn vào lớp này áp dụng cho sync lẫn async."""
+
+# Engine đồng bộ: migration, seed dữ liệu lúc khởi động, script
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
+SessionLocal = sessionmaker(class_=AppSession, autocommit=False, autoflush=False, bind=engine)
+# Engine async: mọi request handler, I/O của các request chạy chồng lên nhau thay vì xếp hàng trên event loop
+async_engine = create_db_engine(async_database_url(SQLALCHEMY_DATABASE_URL), factory=create_async_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, sync_session_class=AppSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 # ============================================================
@@ -38,8 +163,13 @@ class User(Base):
     email = Column(String, unique=True) 
     phone = Column(String) 
     role = Column(String, default="teacher") # admin, teacher, student
-    full_name = Column(String)
-    verification_code = Column(String, nullable=True)
+    full_name = Column(String, index=True)
+    verification_code = Column(String, nullable=True)  # Không còn dùng: mã OTP nằm trong otp_store
+
+    bookings = relationship("Booking", back_populates="user", passive_deletes=True)
+
+    # Lọc theo vai trò + phân trang keyset theo id trên trang quản lý người dùng
+    __table_args__ = (Index("ix_users_role_id", "role", "id"),)
 
 class Classroom(Base):
     __tablename__ = "classrooms"
@@ -49,34 +179,749 @@ class Classroom(Base):
     equipment = Column(String)                        
     status = Column(String, default="Available") # Available, Maintenance
 
+    bookings = relationship("Booking", back_populates="room", passive_deletes=True)
+
 class Booking(Base):
     __tablename__ = "bookings"
     id = Column(Integer, primary_key=True, index=True)
-    room_id = Column(Integer)
-    user_id = Column(Integer)
+    room_id = Column(Integer, ForeignKey("classrooms.id", ondelete="SET NULL"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
     booker_name = Column(String) 
     start_time = Column(String) 
     duration_hours = Column(String)
     status = Column(String, default="Pending") # Pending (Chờ duyệt), Confirmed (Đã duyệt)
+    # Khoảng thời gian đã chuẩn hóa (UTC, naive) để check trùng bằng 1 truy vấn có index
+    start_at = Column(DateTime, nullable=True)
+    end_at = Column(DateTime, nullable=True)
 
-Base.metadata.create_all(bind=engine)
+    room = relationship("Classroom", back_populates="bookings")
+    user = relationship("User", back_populates="bookings")
+
+    # AUTOINCREMENT: SQLite không cấp lại id của lịch đã chuyển sang bookings_archive (id 2 tầng không được trùng)
+    __table_args__ = (Index("ix_bookings_room_interval", "room_id", "start_at", "end_at"), {"sqlite_autoincrement": True})
+
+class BookingArchive(Base):
+    """Lịch đã kết thúc, chuyển khỏi bảng bookings để bảng nóng luôn nhỏ. Chỉ đọc, giữ nguyên id gốc."""
+    __tablename__ = "bookings_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    room_id = Column(Integer)  # Không khóa ngoại: xóa phòng/người dùng thì route tự đặt NULL như bảng bookings
+    user_id = Column(Integer)
+    booker_name = Column(String)
+    start_time = Column(String)
+    duration_hours = Column(String)
+    status = Column(String)
+    start_at = Column(DateTime)
+    end_at = Column(DateTime)
+    archived_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_bookings_archive_user_id", "user_id", "id"),
+        Index("ix_bookings_archive_room_interval", "room_id", "start_at", "end_at"),
+    )
+
+class AuthKV(Base):
+    """Khóa-giá trị có hạn dùng cho xác thực (mã OTP, số lần nhập sai) khi không có Redis."""
+    __tablename__ = "auth_kv"
+    key = Column(String, primary_key=True)
+    value = Column(String)  # JSON
+    expires_at = Column(DateTime, index=True)
 
 # ============================================================
 # 3. KHỞI TẠO APP & CÁC HÀM PHỤ TRỢ (HELPERS)
 # ============================================================
 app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
+
+# --- File tĩnh: URL kèm hash nội dung (?v=...) được trình duyệt cache vĩnh viễn, sửa file là ra URL mới ---
+_static_hashes = {}  # đường dẫn -> ((mtime, size), hash)
+
+def file_hash(path):
+    st = os.stat(path)
+    sig = (st.st_mtime_ns, st.st_size)
+    cached = _static_hashes.get(path)
+    if cached and cached[0] == sig: return cached[1]
+    with open(path, "rb") as f: digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    _static_hashes[path] = (sig, digest)
+    return digest
+
+def static_url(name):
+    return f"/static/{name}?v={file_hash(os.path.join(STATIC_DIR, name))}"
+
+class CachedStaticFiles(StaticFiles):
+    """?v= khớp hash hiện tại -> Cache-Control immutable 1 năm; URL trần hoặc hash cũ -> trình duyệt phải hỏi lại (ETag/304)."""
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        version = dict(p.split("=", 1) for p in scope["query_string"].decode("latin-1").split("&") if "=" in p).get("v")
+        fresh = version is not None and version == file_hash(str(full_path))
+        response.headers["cache-control"] = "public, max-age=31536000, immutable" if fresh else "no-cache"
+        return response
+
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
 templates = Jinja2Templates(directory="templates")
 templates.env.filters['tojson'] = json_dumps
+templates.env.globals['static_url'] = static_url
+if JINJA_CACHE_DIR:
+    # Bytecode của template lưu ra đĩa: worker mới/khởi động lại không phải biên dịch lại từ đầu
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+def warm_templates():
+    """Nạp sẵn mọi template lúc khởi động để request đầu tiên không phải biên dịch."""
+    for name in templates.env.list_templates(extensions=["html"]): templates.env.get_template(name)
+
+def etag_matches(request, etag):
+    """So If-None-Match kiểu yếu (RFC 9110): bỏ tiền tố W/ hai bên, vì response nén bị đổi sang ETag yếu."""
+    tags = [t.strip().removeprefix("W/") for t in request.headers.get("if-none-match", "").split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def render_page(name, context):
+    """TemplateResponse + ETag theo nội dung: trình duyệt gửi lại If-None-Match trùng thì trả 304, không gửi lại HTML."""
+    response = templates.TemplateResponse(name, context)
+    etag = f'W/"{hashlib.blake2b(response.body, digest_size=12).hexdigest()}"'
+    headers = {"etag": etag, "cache-control": "private, no-cache"}  # Trang theo người dùng: chỉ trình duyệt cache, luôn hỏi lại
+    if etag_matches(context["request"], etag): return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return response
+
+async def get_db():
+    async with AsyncSessionLocal() as db: yield db
+
+# --- Giám sát: latency theo route, truy vấn DB theo request, SMTP -> /metrics (định dạng text của Prometheus) ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+def _prom_labels(key):
+    if not key: return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in key) + "}"
+
+class Metrics:
+    """Counter/histogram tối giản trong tiến trình. Mỗi worker có số liệu riêng (Prometheus cộng theo instance)."""
+    def __init__(self):
+        self.counters = {}    # tên -> {nhãn: giá trị}
+        self.histograms = {}  # tên -> {nhãn: [đếm theo bucket..., +Inf, tổng, số lần]}
+        self.buckets = {}     # tên histogram -> bucket riêng (mặc định LATENCY_BUCKETS)
+        self.gauges = {}      # tên -> hàm đọc giá trị lúc scrape
+        self.lock = threading.Lock()  # SMTP ghi số liệu từ thread khác
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        buckets = self.buckets.get(name, LATENCY_BUCKETS)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            h = series.get(key)
+            if h is None: h = series[key] = [0] * (len(buckets) + 3)
+            h[bisect.bisect_left(buckets, value)] += 1
+            h[-2] += value; h[-1] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                lines.extend(f"{name}{_prom_labels(key)} {value}" for key, value in series.items())
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                bounds = [*map(str, self.buckets.get(name, LATENCY_BUCKETS)), "+Inf"]
+                for key, h in series.items():
+                    cumulative = 0
+                    for le, n in zip(bounds, h):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{_prom_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_prom_labels(key)} {h[-2]}")
+                    lines.append(f"{name}_count{_prom_labels(key)} {h[-1]}")
+        for name, read in sorted(self.gauges.items()):
+            lines += [f"# TYPE {name} gauge", f"{name} {read()}"]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.buckets["db_queries_per_request"] = COUNT_BUCKETS
+
+class RequestStats:
+    """Số truy vấn/thời gian DB của 1 request; các câu SQL giống hệt nhau được đếm để phát hiện N+1."""
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, elapsed):
+        self.queries += 1
+        self.db_seconds += elapsed
+        self.statements[statement] += 1
+
+    def check_n_plus_one(self, route):
+        if not self.statements: return
+        statement, n = self.statements.most_common(1)[0]
+        if n > N_PLUS_ONE_THRESHOLD:
+            metrics.inc("db_n_plus_one_total", route=route)
+            print(f"Cảnh báo N+1: {route} chạy {n} lần cùng 1 câu SQL: {' '.join(statement.split())[:200]}")
+
+# Greenlet của SQLAlchemy async kế thừa context của task nên hook engine thấy được request hiện tại
+current_request_stats = ContextVar("current_request_stats", default=None)
+
+def instrument_engine(sync_engine):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        metrics.observe("db_query_duration_seconds", elapsed)
+        stats = current_request_stats.get()
+        if stats is not None: stats.record(statement, elapsed)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"): conn.info["query_start"].pop()
+        metrics.inc("db_query_errors_total")
+
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
+class InstrumentationMiddleware:
+    """ASGI middleware: latency + mã trạng thái theo route, số truy vấn/thời gian DB mỗi request, cảnh báo N+1.
+
+    Header X-Profile: <PROFILE_TOKEN> trả về báo cáo cProfile của request thay cho response thật.
+    cProfile đo cả thread nên các request chạy chồng lúc đó cũng lẫn vào báo cáo.
+    """
+    def __init__(self, app): self.app = app
+
+    @staticmethod
+    def _route(scope):
+        route = scope.get("route")  # FastAPI gắn route khớp vào scope -> nhãn theo mẫu path, không theo id
+        if route is not None: return route.path
+        return "/static" if scope["path"].startswith("/static/") else "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http": return await self.app(scope, receive, send)
+        profiler = None
+        wanted = dict(scope["headers"]).get(b"x-profile", b"").decode("latin-1")
+        if PROFILE_TOKEN and wanted and hmac.compare_digest(wanted, PROFILE_TOKEN):
+            profiler = cProfile.Profile()
+            try: profiler.enable()
+            except ValueError: profiler = None  # Đang có request khác profile
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start": status = message["status"]
+            if profiler is None: await send(message)  # Đang profile: bỏ response thật, trả báo cáo ở cuối
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        t0 = time.perf_counter()
+        try: await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            if profiler is not None: profiler.disable()
+            current_request_stats.reset(token)
+            route, method = self._route(scope), scope["method"]
+            metrics.observe("http_request_duration_seconds", elapsed, method=method, route=route)
+            metrics.inc("http_requests_total", method=method, route=route, status=str(status))
+            metrics.observe("db_queries_per_request", stats.queries, route=route)
+            metrics.observe("db_seconds_per_request", stats.db_seconds, route=route)
+            stats.check_n_plus_one(route)
+        if profiler is not None: await self._send_profile(send, profiler, status, elapsed, stats)
+
+    @staticmethod
+    async def _send_profile(send, profiler, status, elapsed, stats):
+        out = io.StringIO()
+        out.write(f"status={status} elapsed={elapsed * 1000:.1f}ms db_queries={stats.queries} db_time={stats.db_seconds * 1000:.1f}ms\n")
+        for statement, n in stats.statements.most_common(5): out.write(f"  {n}x {' '.join(statement.split())[:160]}\n")
+        out.write("\n")
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+        body = out.getvalue().encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/plain; charset=utf-8"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+# --- Nén response: br (nếu cài brotli) hoặc gzip theo Accept-Encoding, cả response stream (CSV/ICS) ---
+class _GzipStream:
+    def __init__(self): self.z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = định dạng gzip
+
+    def compress(self, data, final): return self.z.compress(data) + self.z.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+class _BrotliStream:
+    def __init__(self): self.c = brotli.Compressor(quality=5)
+
+    def compress(self, data, final): return self.c.process(data) + (self.c.finish() if final else self.c.flush())
+
+COMPRESSORS = {"br": _BrotliStream, "gzip": _GzipStream}
+
+def pick_encoding(accept_encoding):
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        q = params.strip()[2:] if params.strip().startswith("q=") else "1"
+        try: offered[name.strip()] = float(q)
+        except ValueError: continue
+    for encoding in (["br"] if brotli else []) + ["gzip"]:
+        if offered.get(encoding, 0) > 0: return encoding
+    return None
+
+class CompressionMiddleware:
+    """Giữ http.response.start tới khi thấy body: body trọn vẹn dưới minimum_size, kiểu không nén được,
+    SSE hay response đã nén sẵn thì gửi nguyên; còn lại nén và bỏ Content-Length."""
+    COMPRESSIBLE = ("text/html", "text/css", "text/plain", "text/csv", "text/calendar", "application/json", "application/javascript", "image/svg+xml")
+
+    def __init__(self, app, minimum_size=1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    def _compressible(self, headers):
+        return headers.get("content-type", "").startswith(self.COMPRESSIBLE) and "content-encoding" not in headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http": return await self.app(scope, receive, send)
+        encoding = pick_encoding(dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None: return await self.app(scope, receive, send)
+        start, compressor = None, None
+
+        async def send_wrapper(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body": return await send(message)
+            body, more = message.get("body", b""), message.get("more_body", False)
+            if start is not None:
+                pending, start = start, None
+                headers = MutableHeaders(raw=pending["headers"])
+                if self._compressible(headers) and (more or len(body) >= self.minimum_size):
+                    compressor = COMPRESSORS[encoding]()
+                    headers["content-encoding"] = encoding
+                    headers.add_vary_header("Accept-Encoding")
+                    if "content-length" in headers: del headers["content-length"]
+                    etag = headers.get("etag")
+                    if etag and not etag.startswith("W/"): headers["etag"] = "W/" + etag  # Byte khác bản gốc -> ETag yếu
+                    metrics.inc("http_compressed_responses_total", encoding=encoding)
+                await send(pending)
+            if compressor is None: return await send(message)
+            await send({"type": "http.response.body", "body": compressor.compress(body, not more), "more_body": more})
+
+        await self.app(scope, receive, send_wrapper)
+
+# Thêm trước -> nằm trong InstrumentationMiddleware: latency đo cả thời gian nén
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESS_MIN_SIZE)
+app.add_middleware(InstrumentationMiddleware)
+
+# --- Hàm xử lý thời gian đặt phòng ---
+MAX_BOOKING_HOURS = 24
+
+def parse_duration_hours(duration_text, strict=False):
+    """Đổi chuỗi thời lượng ("2 Giờ 30 Phút", "30 Phút", "1.5") sang số giờ.
+
+    strict (lịch đặt mới): chỉ nhận dạng "X Giờ"/"Y Phút" của client, 0 < số giờ <= MAX_BOOKING_HOURS, sai thì ValueError.
+    Không strict: đọc lỏng cho dữ liệu cũ lúc backfill start_at/end_at.
+    """
+    duration_text = str(duration_text or "")
+    if "Giờ" in duration_text:
+        parts = duration_text.split(" Giờ")
+        hours = float(int(parts[0]))
+        if "Phút" in parts[1]: hours += 0.5
+    elif "Phút" in duration_text: hours = 0.5
+    elif strict: raise ValueError(f"Thời lượng không hợp lệ: {duration_text!r}")
+    else:
+        try: return float(duration_text) if duration_text else 1.0
+        except ValueError: return 1.0
+    if strict and not 0 < hours <= MAX_BOOKING_HOURS: raise ValueError(f"Thời lượng ngoài khoảng cho phép: {duration_text!r}")
+    return hours
+
+def parse_start_time(start_time):
+    """Đọc chuỗi ISO từ client, trả về datetime UTC không kèm tzinfo (dạng lưu trong DB)."""
+    dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
+    if dt.tzinfo: dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def booking_interval(start_time, duration_text, strict=False):
+    start = parse_start_time(start_time)
+    return start, start + timedelta(hours=parse_duration_hours(duration_text, strict))
+
+def booking_to_dict(b):
+    return {
+        "id": b.id, "room_id": b.room_id, "user_id": b.user_id, "booker_name": b.booker_name,
+        "start_time": b.start_time, "duration_hours": b.duration_hours, "status": b.status,
+        "start_at": b.start_at.isoformat() + "Z" if b.start_at else None,
+        "end_at": b.end_at.isoformat() + "Z" if b.end_at else None,
+    }
+
+# --- Khóa đặt lịch theo phòng (check trùng + insert trong cùng 1 vùng khóa) ---
+async def lock_rooms(db, room_ids):
+    """Giữ khóa ghi trên các phòng tới hết transaction hiện tại.
+
+    PostgreSQL: khóa dòng trong classrooms, chỉ các request cùng phòng phải chờ nhau.
+    SQLite: câu UPDATE mở ngay transaction ghi (như BEGIN IMMEDIATE) nên các lần đọc sau luôn thấy dữ liệu mới nhất.
+    """
+    table = Classroom.__table__
+    for room_id in sorted(set(room_ids)):  # Khóa theo thứ tự id để không deadlock khi khóa nhiều phòng
+        await db.execute(table.update().where(table.c.id == room_id).values(status=table.c.status))
+
+def conflict_message(b):
+    vn_start = b.start_at + timedelta(hours=7)
+    vn_end = b.end_at + timedelta(hours=7)
+    return f"Bị trùng! Đã có lịch của {b.booker_name} ({vn_start.strftime('%H:%M')} - {vn_end.strftime('%H:%M')})"
+
+# --- Đặt lịch hàng loạt (thời khóa biểu cả học kỳ) ---
+BULK_MAX_ITEMS = 10000
+
+def expand_bulk_items(data):
+    """Gom các nguồn trong request (items, csv, recurrences) thành 1 danh sách room_id/start_time/duration_display."""
+    items = list(data.get('items') or [])
+    if data.get('csv'):
+        # Dòng đầu là header: room_id,start_time,duration_display
+        items += list(csv.DictReader(io.StringIO(data['csv'])))
+    for rule in data.get('recurrences') or []:
+        # Lặp mỗi every_days ngày (mặc định hằng tuần), dừng sau count lần hoặc khi qua until
+        if not rule.get('count') and not rule.get('until'):
+            raise HTTPException(status_code=400, detail="Lịch lặp cần count hoặc until!")
+        first = parse_start_time(rule['start_time'])
+        step = timedelta(days=int(rule.get('every_days', 7)))
+        until = parse_start_time(rule['until']) if rule.get('until') else None
+        for k in range(int(rule.get('count') or BULK_MAX_ITEMS)):
+            start = first + k * step
+            if (until and start > until) or len(items) > BULK_MAX_ITEMS: break
+            items.append({
+                "room_id": rule['room_id'], "duration_display": rule['duration_display'],
+                "start_time": start.isoformat(timespec='milliseconds') + "Z",
+            })
+    return items
+
+def sweep_conflicts(existing, requested):
+    """Check trùng cả lô của 1 phòng bằng 1 lần quét theo giờ bắt đầu.
+
+    existing: [(start, end, booking)] đã có trong DB; requested: [(start, end, index)] trong lô.
+    Trả về {index: booking hoặc index của mục trong lô bị trùng}. Mục trùng không được tính là đã giữ chỗ.
+    """
+    existing = sorted(existing, key=lambda x: x[0])
+    conflicts = {}
+    i, existing_end, existing_by = 0, None, None
+    accepted_end, accepted_by = None, None
+    for start, end, index in sorted(requested, key=lambda x: (x[0], x[2])):
+        # Gộp các lịch cũ bắt đầu trước mục này, chỉ cần nhớ lịch kết thúc muộn nhất
+        while i < len(existing) and existing[i][0] < start:
+            if existing_end is None or existing[i][1] > existing_end: existing_end, existing_by = existing[i][1], existing[i][2]
+            i += 1
+        if existing_end is not None and existing_end > start: conflicts[index] = existing_by
+        elif i < len(existing) and existing[i][0] < end: conflicts[index] = existing[i][2]
+        elif accepted_end is not None and accepted_end > start: conflicts[index] = accepted_by
+        else: accepted_end, accepted_by = end, index
+    return conflicts
+
+def parse_booking_ids(data):
+    try: ids = [int(x) for x in data['booking_ids']]
+    except (KeyError, TypeError, ValueError): raise HTTPException(status_code=400, detail="booking_ids không hợp lệ!")
+    if len(ids) > BULK_MAX_ITEMS: raise HTTPException(status_code=400, detail=f"Tối đa {BULK_MAX_ITEMS} lịch mỗi lần!")
+    return ids
+
+# --- Cursor phân trang kiểu keyset (start_at, id) ---
+def encode_cursor(start_at, booking_id):
+    return base64.urlsafe_b64encode(f"{start_at.isoformat()}|{booking_id}".encode()).decode()
+
+def decode_cursor(cursor):
+    start_at, booking_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(start_at), int(booking_id)
+
+# --- Migration: thêm cột start_at/end_at + index cho DB cũ và backfill dữ liệu ---
+def migrate_booking_intervals(batch_size=1000):
+    columns = {c["name"] for c in inspect(engine).get_columns("bookings")}
+    with engine.begin() as conn:
+        for name in ("start_at", "end_at"):
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE bookings ADD COLUMN {name} TIMESTAMP"))
+    for index in Booking.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
 
-def get_db():
     db = SessionLocal()
-    try: yield db
-    finally: db.close()
+    try:
+        last_id = 0
+        while True:
+            rows = db.query(Booking).filter(Booking.id > last_id, Booking.start_at.is_(None)) \
+                .order_by(Booking.id).limit(batch_size).all()
+            if not rows: break
+            for b in rows:
+                try: b.start_at, b.end_at = booking_interval(b.start_time, b.duration_hours)
+                except (AttributeError, TypeError, ValueError): continue  # Dòng hỏng: bỏ qua như logic cũ
+                b.end_at = min(b.end_at, b.start_at + timedelta(hours=MAX_BOOKING_HOURS))
+            last_id = rows[-1].id
+            db.commit()
+    finally:
+        db.close()
+    clamp_long_bookings()
+
+def clamp_long_bookings():
+    """Lịch nhập trước khi có kiểm tra thời lượng có thể dài hơn MAX_BOOKING_HOURS: cắt end_at về đúng giới hạn,
+    vì check trùng (overlaps) chỉ tìm lịch bắt đầu trong MAX_BOOKING_HOURS giờ trước khung cần xét."""
+    limit = timedelta(hours=MAX_BOOKING_HOURS)
+    with engine.begin() as conn:
+        for t in (Booking.__table__, BookingArchive.__table__):
+            if engine.dialect.name == "sqlite": too_long = func.julianday(t.c.end_at) - func.julianday(t.c.start_at) > limit / timedelta(days=1) + 1e-6
+            else: too_long = t.c.end_at - t.c.start_at > limit
+            rows = conn.execute(select(t.c.id, t.c.start_at).where(too_long)).all()
+            for r in rows: conn.execute(update(t).where(t.c.id == r.id).values(end_at=r.start_at + limit))
+            if rows: print(f"Đã cắt {len(rows)} lịch dài hơn {MAX_BOOKING_HOURS} giờ trong bảng {t.name}.")
+
+# --- Migration: id của bookings chỉ tăng (SQLite) ---
+def migrate_booking_ids():
+    """Bảng bookings cũ là INTEGER PRIMARY KEY không AUTOINCREMENT: xóa lịch có id lớn nhất (lưu trữ) thì id bị cấp lại.
+    Dựng lại bảng có AUTOINCREMENT, bộ đếm bắt đầu sau id lớn nhất của cả 2 tầng. Lịch đã trùng id với kho lưu trữ
+    (do lỗi cũ) được cấp id mới để job lưu trữ chạy tiếp được."""
+    if engine.dialect.name != "sqlite": return  # PostgreSQL: sequence không bao giờ cấp lại id
+    with engine.begin() as conn:
+        ddl = conn.scalar(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'bookings'"))
+        if "AUTOINCREMENT" in ddl.upper(): return
+        columns = ", ".join(c.name for c in Booking.__table__.columns)
+        data_columns = ", ".join(c.name for c in Booking.__table__.columns if c.name != "id")
+        conn.execute(text("ALTER TABLE bookings RENAME TO bookings_old"))
+        for name in conn.scalars(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'bookings_old' AND sql IS NOT NULL")).all():
+            conn.execute(text(f'DROP INDEX "{name}"'))
+        Booking.__table__.create(conn)
+        conn.execute(text(f"INSERT INTO bookings ({columns}) SELECT {columns} FROM bookings_old "
+                          "WHERE id NOT IN (SELECT id FROM bookings_archive) ORDER BY id"))
+        top = conn.scalar(text("SELECT MAX(id) FROM (SELECT id FROM bookings UNION ALL SELECT id FROM bookings_archive)")) or 0
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'bookings'"))
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('bookings', :top)"), {"top": top})
+        moved = conn.execute(text(f"INSERT INTO bookings ({data_columns}) SELECT {data_columns} FROM bookings_old "
+                                  "WHERE id IN (SELECT id FROM bookings_archive) ORDER BY id")).rowcount
+        conn.execute(text("DROP TABLE bookings_old"))
+    print(f"Đã chuyển bảng bookings sang id AUTOINCREMENT ({moved} lịch trùng id với kho lưu trữ được cấp id mới).")
+
+# --- Migration: index + bảng FTS5 cho tìm kiếm người dùng (SQLite) ---
+# Bảng FTS "external content" trỏ vào users, trigger giữ đồng bộ; bỏ dấu để "nguyen" khớp "Nguyễn"
+USER_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        username, full_name, email, content='users', content_rowid='id', tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(rowid, username, full_name, email) VALUES (new.id, new.username, new.full_name, new.email);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, username, full_name, email) VALUES ('delete', old.id, old.username, old.full_name, old.email);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username, full_name, email ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, username, full_name, email) VALUES ('delete', old.id, old.username, old.full_name, old.email);
+        INSERT INTO users_fts(rowid, username, full_name, email) VALUES (new.id, new.username, new.full_name, new.email);
+    END""",
+]
+user_fts_enabled = False
+
+def migrate_user_search():
+    global user_fts_enabled
+    for index in User.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    if engine.dialect.name != "sqlite": return
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'")).first()
+            for ddl in USER_FTS_DDL: conn.execute(text(ddl))
+            if not exists: conn.execute(text("INSERT INTO users_fts(users_fts) VALUES ('rebuild')"))
+        user_fts_enabled = True
+    except OperationalError as e:
+        print(f"SQLite không hỗ trợ FTS5, tìm người dùng bằng LIKE: {e}")
+
+def detect_user_search():
+    """Worker không chạy migration: chỉ kiểm tra bảng FTS đã được tiến trình khởi tạo tạo chưa."""
+    global user_fts_enabled
+    if engine.dialect.name != "sqlite": return
+    with engine.connect() as conn:
+        user_fts_enabled = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'")).first() is not None
+
+def user_search_filter(q):
+    """Tìm theo tiền tố trên username, full_name, email: FTS5 nếu có, ngược lại LIKE 'q%' (PostgreSQL)."""
+    words = re.findall(r"\w+", q)
+    if user_fts_enabled and words:
+        # Mỗi từ thành 1 tiền tố FTS5: "nguyen"* "van"*
+        terms = " ".join(f'"{w}"*' for w in words)
+        return text("users.id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH :terms)").bindparams(terms=terms)
+    pattern = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return or_(*(col.ilike(pattern, escape="\\") for col in (User.username, User.full_name, User.email)))
+
+# --- Kho lưu trữ lịch cũ: bookings (nóng) + bookings_archive (lịch đã kết thúc) ---
+BOOKING_COLUMNS = ("id", "room_id", "user_id", "booker_name", "start_time", "duration_hours", "status", "start_at", "end_at")
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def archive_cutoff():
+    """Mốc lưu trữ: mọi lịch trong bookings_archive đều kết thúc trước mốc này."""
+    return utc_now() - timedelta(hours=ARCHIVE_AFTER_HOURS)
+
+def booking_tiers(window_from):
+    """Các bảng cần đọc cho khung giờ từ window_from: khung nằm hẳn sau mốc lưu trữ thì chỉ đọc bảng nóng."""
+    if window_from is not None and window_from >= archive_cutoff(): return (Booking.__table__,)
+    return (Booking.__table__, BookingArchive.__table__)
+
+def union_tiers(tables, build):
+    """build(bảng) -> select trên 1 bảng; ghép các tầng bằng UNION ALL thành 1 subquery có cùng tên cột."""
+    queries = [build(t) for t in tables]
+    return (queries[0] if len(queries) == 1 else union_all(*queries)).subquery()
+
+def overlaps(t, start, end):
+    """Điều kiện lịch giao [start, end). Lịch dài tối đa MAX_BOOKING_HOURS nên thêm cận dưới cho start_at:
+    index (room_id, start_at, end_at) chỉ quét 1 khoảng hẹp thay vì toàn bộ lịch sử trước end."""
+    return (t.c.start_at < end, t.c.start_at > start - timedelta(hours=MAX_BOOKING_HOURS), t.c.end_at > start)
+
+async def archive_bookings(db, *criteria, limit=None):
+    """Chuyển các lịch thỏa điều kiện sang bookings_archive trong transaction hiện tại, trả về số lịch đã chuyển."""
+    q = select(Booking.id).where(*criteria).order_by(Booking.id)
+    if limit: q = q.limit(limit)
+    # PostgreSQL: nhiều worker chạy job cùng lúc thì mỗi worker lấy 1 lô khác nhau
+    if async_engine.dialect.name == "postgresql": q = q.with_for_update(skip_locked=True)
+    ids = list(await db.scalars(q))
+    if not ids: return 0
+    hot = Booking.__table__
+    await db.execute(insert(BookingArchive).from_select(
+        [*BOOKING_COLUMNS, "archived_at"], select(*(hot.c[n] for n in BOOKING_COLUMNS), literal(utc_now())).where(hot.c.id.in_(ids))))
+    await db.execute(delete(Booking).where(Booking.id.in_(ids)))
+    return len(ids)
+
+class BookingArchiver:
+    """Job nền: định kỳ chuyển lịch đã kết thúc sang bookings_archive theo lô, mỗi lô 1 transaction ngắn."""
+    def __init__(self, interval, batch_size):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.task = None
+
+    async def start(self):
+        if self.interval > 0: self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task: self.task.cancel()
+        await asyncio.gather(*[t for t in (self.task,) if t], return_exceptions=True)
+
+    async def run_once(self):
+        total = 0
+        while True:
+            async with AsyncSessionLocal() as db:
+                moved = await archive_bookings(db, Booking.end_at < archive_cutoff(), limit=self.batch_size)
+                await db.commit()
+            total += moved
+            metrics.inc("bookings_archived_total", moved)
+            if moved < self.batch_size: return total
+            await asyncio.sleep(0)  # Nhường event loop cho request giữa các lô
+
+    async def _loop(self):
+        while True:
+            try:
+                moved = await self.run_once()
+                if moved: print(f"Đã lưu trữ {moved} lịch đã kết thúc.")
+            except Exception as e:  # SQLite nhiều worker: worker chậm chân gặp lỗi khóa, lần chạy sau làm tiếp
+                print(f"Lỗi lưu trữ lịch: {e}")
+            await asyncio.sleep(self.interval)
+
+booking_archiver = BookingArchiver(ARCHIVE_INTERVAL, ARCHIVE_BATCH_SIZE)
+
+# --- Hàng đợi gửi Email chạy nền (giữ kết nối SMTP, gửi theo lô, thử lại có backoff) ---
+class MailDispatcher:
+    def __init__(self, workers=1, batch_size=20, max_retries=3, backoff=1.0, idle_timeout=30.0, maxsize=1000):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.tasks = []
+
+    async def start(self):
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout=10.0):
+        try: await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError: print("Hết thời gian chờ gửi email khi tắt server, bỏ các email còn lại.")
+        for t in self.tasks: t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def enqueue(self, receiver_email, msg):
+        """Đưa email vào hàng đợi, trả về False nếu hàng đợi đầy. Không chặn event loop."""
+        try: self.queue.put_nowait((receiver_email, msg))
+        except asyncio.QueueFull:
+            metrics.inc("smtp_queue_full_total")
+            return False
+        return True
+
+    def _connect(self):
+        t0 = time.perf_counter()
+        smtp_cls = smtplib.SMTP_SSL if SMTP_SSL else smtplib.SMTP
+        conn = smtp_cls(SMTP_HOST, SMTP_PORT, timeout=30)
+        if SENDER_PASSWORD: conn.login(SENDER_EMAIL, SENDER_PASSWORD)
+        metrics.observe("smtp_connect_duration_seconds", time.perf_counter() - t0)
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        if conn is None: return
+        try: conn.quit()
+        except Exception: conn.close()
+
+    @staticmethod
+    def _permanent(e):
+        """Lỗi của riêng 1 email (địa chỉ bị từ chối, mã 5xx): thử lại cũng vô ích, không được kéo cả lô theo."""
+        if isinstance(e, smtplib.SMTPRecipientsRefused): return True
+        return isinstance(e, (smtplib.SMTPDataError, smtplib.SMTPSenderRefused)) and 500 <= e.smtp_code < 600
+
+    def _send_batch(self, conn, pending):
+        # Chạy trong thread: gửi lần lượt, email gửi xong (hoặc bị từ chối hẳn) được bỏ khỏi pending
+        try:
+            if conn is None: conn = self._connect()
+            while pending:
+                receiver_email, msg = pending[0]
+                t0 = time.perf_counter()
+                try: conn.sendmail(SENDER_EMAIL, receiver_email, msg.as_string())
+                except smtplib.SMTPException as e:
+                    if not self._permanent(e): raise  # Lỗi kết nối/tạm thời: thử lại cả phần còn lại của lô
+                    metrics.inc("smtp_emails_dropped_total")
+                    print(f"Bỏ email tới {receiver_email}: {e}")
+                else:
+                    metrics.observe("smtp_send_duration_seconds", time.perf_counter() - t0)
+                    metrics.inc("smtp_emails_sent_total")
+                pending.pop(0)
+            return conn
+        except Exception:
+            self._close(conn)
+            raise
+
+    async def _deliver(self, conn, batch):
+        pending = list(batch)
+        for attempt in range(self.max_retries + 1):
+            try: return await asyncio.to_thread(self._send_batch, conn, pending)
+            except Exception as e:
+                conn = None
+                metrics.inc("smtp_send_failures_total")
+                print(f"Lỗi gửi email (lần {attempt + 1}): {e}")
+                if attempt < self.max_retries: await asyncio.sleep(self.backoff * 2 ** attempt)
+        metrics.inc("smtp_emails_dropped_total", len(pending))
+        print(f"Bỏ {len(pending)} email sau {self.max_retries + 1} lần thử.")
+        return None
+
+    async def _worker(self):
+        conn = None
+        try:
+            while True:
+                try: first = await asyncio.wait_for(self.queue.get(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    # Rảnh quá lâu -> đóng kết nối, lần gửi sau sẽ mở lại
+                    await asyncio.to_thread(self._close, conn); conn = None
+                    continue
+                batch = [first]
+                while len(batch) < self.batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                try: conn = await self._deliver(conn, batch)
+                finally:
+                    for _ in batch: self.queue.task_done()
+        finally:
+            self._close(conn)
+
+mail_dispatcher = MailDispatcher(workers=MAIL_WORKERS)
 
-# --- Hàm gửi Email (Dùng SSL Port 465 để chạy trên Render) ---
 def send_verification_email(receiver_email):
-    verification_code = str(random.randint(100000, 999999))
+    """Tạo mã OTP và xếp email vào hàng đợi. Trả về mã OTP, hoặc None nếu hàng đợi đầy."""
+    verification_code = f"{secrets.randbelow(10 ** 6):06d}"
     subject = "Mã xác thực EduManager"
     
     body = f"""
@@ -93,65 +938,721 @@ def send_verification_email(receiver_email):
     msg['Subject'] = subject
     msg.attach(MIMEText(body, 'html'))
 
+    if not mail_dispatcher.enqueue(receiver_email, msg): return None
+    return verification_code
+
+# --- Kho key-value có TTL cho xác thực: mã OTP đang chờ, số lần nhập sai, token bucket giới hạn tần suất ---
+class MemoryKVStore:
+    """Trong tiến trình: mỗi khóa có hạn riêng, đầy thì bỏ khóa lâu không dùng nhất (LRU)."""
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.data = OrderedDict()  # khóa -> (hết hạn, giá trị)
+
+    def _get(self, key):
+        item = self.data.get(key)
+        if item is None: return None
+        if item[0] < time.monotonic():
+            del self.data[key]
+            return None
+        self.data.move_to_end(key)
+        return item
+
+    def _set(self, key, value, ttl):
+        self.data[key] = (time.monotonic() + ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize: self.data.popitem(last=False)
+
+    async def get(self, key):
+        item = self._get(key)
+        return item[1] if item else None
+
+    async def set(self, key, value, ttl): self._set(key, value, ttl)
+
+    async def delete(self, key): self.data.pop(key, None)
+
+    async def incr(self, key, ttl):
+        """Tăng bộ đếm, hạn tính từ lần tăng đầu tiên."""
+        item = self._get(key)
+        if item is None: self._set(key, 1, ttl); return 1
+        self.data[key] = (item[0], item[1] + 1)
+        return item[1] + 1
+
+    async def take_token(self, key, capacity, refill_seconds):
+        """Token bucket: đầy capacity lượt, cứ refill_seconds hồi 1 lượt. Trả về số giây phải chờ (0 = được phép)."""
+        now = time.monotonic()
+        item = self._get(key)
+        tokens, last = item[1] if item else (capacity, now)
+        tokens = min(capacity, tokens + (now - last) / refill_seconds)
+        allowed = tokens >= 1
+        if allowed: tokens -= 1
+        self._set(key, (tokens, now), capacity * refill_seconds)
+        return 0 if allowed else (1 - tokens) * refill_seconds
+
+class RedisKVStore:
+    """Dùng chung giữa các worker/máy qua Redis; token bucket chạy bằng Lua nên trừ lượt là nguyên tử."""
+    TOKEN_BUCKET = """
+    local now, capacity, refill = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+    local tokens, last = tonumber(state[1]) or capacity, tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - last) / refill)
+    local wait = 0
+    if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) * refill end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'last', now)
+    redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * refill * 1000))
+    return tostring(wait)
+    """
+
+    def __init__(self, url):
+        import redis.asyncio as redis  # Chỉ cần khi bật AUTH_STORE_URL
+        self.client = redis.from_url(url)
+        self.bucket_script = self.client.register_script(self.TOKEN_BUCKET)
+
+    async def get(self, key):
+        raw = await self.client.get(key)
+        return json_loads(raw) if raw is not None else None
+
+    async def set(self, key, value, ttl): await self.client.set(key, json_dumps(value), px=int(ttl * 1000))
+
+    async def delete(self, key): await self.client.delete(key)
+
+    async def incr(self, key, ttl):
+        n = await self.client.incr(key)
+        if n == 1: await self.client.pexpire(key, int(ttl * 1000))
+        return n
+
+    async def take_token(self, key, capacity, refill_seconds):
+        return float(await self.bucket_script(keys=[key], args=[time.time(), capacity, refill_seconds]))
+
+class DatabaseKVStore:
+    """Mặc định cho mã OTP: nằm trong bảng auth_kv nên gửi mã ở worker này, xác nhận ở worker khác vẫn đúng."""
+    async def get(self, key):
+        async with AsyncSessionLocal() as db:
+            row = await db.get(AuthKV, key)
+            return json_loads(row.value) if row and row.expires_at > utc_now() else None
+
+    async def set(self, key, value, ttl):
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(AuthKV).where(AuthKV.expires_at < utc_now()))  # Dọn luôn các khóa đã hết hạn
+            await db.merge(AuthKV(key=key, value=json_dumps(value), expires_at=utc_now() + timedelta(seconds=ttl)))
+            await db.commit()
+
+    async def delete(self, key):
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(AuthKV).where(AuthKV.key == key))
+            await db.commit()
+
+    async def incr(self, key, ttl):
+        """Tăng ngay trong câu UPDATE để 2 lần nhập sai cùng lúc không ghi đè nhau."""
+        async with AsyncSessionLocal() as db:
+            n = await db.scalar(update(AuthKV).where(AuthKV.key == key, AuthKV.expires_at > utc_now())
+                                .values(value=cast(cast(AuthKV.value, Integer) + 1, String)).returning(AuthKV.value)
+                                .execution_options(synchronize_session=False))
+            if n is None:
+                n = 1
+                await db.merge(AuthKV(key=key, value="1", expires_at=utc_now() + timedelta(seconds=ttl)))
+            await db.commit()
+            return int(n)
+
+# Token bucket tính ở mỗi request đăng nhập nên giữ trong bộ nhớ (mỗi worker 1 bộ đếm) trừ khi có Redis
+if AUTH_STORE_URL.startswith("redis"): auth_store = rate_store = RedisKVStore(AUTH_STORE_URL)
+else: auth_store, rate_store = DatabaseKVStore(), MemoryKVStore()
+
+class OTPStore:
+    """Mã OTP đang chờ theo (mục đích, đối tượng): hết hạn sau OTP_TTL, nhập sai OTP_MAX_ATTEMPTS lần thì mã bị hủy."""
+    def __init__(self, store, ttl, max_attempts):
+        self.store = store
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+
+    async def issue(self, purpose, subject, code):
+        key = f"otp:{purpose}:{subject}"
+        await self.store.delete(f"{key}:fails")
+        await self.store.set(key, code, self.ttl)
+
+    async def verify(self, purpose, subject, code):
+        key = f"otp:{purpose}:{subject}"
+        expected = await self.store.get(key)
+        if expected is None: return False
+        if hmac.compare_digest(str(expected), str(code or "")):
+            await self.store.delete(key)  # Mỗi mã chỉ dùng 1 lần
+            return True
+        if await self.store.incr(f"{key}:fails", self.ttl) >= self.max_attempts: await self.store.delete(key)
+        return False
+
+otp_store = OTPStore(auth_store, OTP_TTL, OTP_MAX_ATTEMPTS)
+
+# Token bucket theo IP và theo tài khoản: (số lượt liền tay, số giây hồi 1 lượt)
+RATE_LIMITS = {
+    "login": {"ip": (20, 3.0), "account": (10, 6.0)},
+    "otp": {"ip": (5, 120.0), "account": (3, 200.0)},
+}
+
+def client_ip(request):
+    return request.client.host if request.client else "unknown"
+
+async def rate_limit(request, scope, account=None):
+    """Gọi đầu handler, trước mọi truy vấn DB / gửi mail. Trả về response 429 nếu IP hoặc tài khoản đã hết lượt."""
+    if not RATE_LIMIT_ENABLED: return None
+    limits = RATE_LIMITS[scope]
+    checks = [("ip", client_ip(request))] + ([("account", str(account).strip().lower())] if account else [])
+    for kind, subject in checks:
+        wait = await rate_store.take_token(f"rl:{scope}:{kind}:{subject}", *limits[kind])
+        if wait:
+            metrics.inc("rate_limited_total", scope=scope, kind=kind)
+            retry = max(1, int(wait + 0.999))
+            return Response(json_dumps({"status": "error", "message": f"Thao tác quá nhiều lần, thử lại sau {retry} giây!"}),
+                            status_code=429, media_type="application/json", headers={"Retry-After": str(retry)})
+    return None
+
+# --- Sự kiện lịch đặt realtime (SSE): pub/sub trong tiến trình, backend cắm thêm để fan-out nhiều worker ---
+class LocalEventBackend:
+    """Mặc định: sự kiện chỉ tới các client đang nối vào chính worker này."""
+    async def start(self, deliver): self.deliver = deliver
+    async def publish(self, event): self.deliver(event)
+    async def stop(self): pass
+
+class RedisEventBackend:
+    """Phát qua Redis pub/sub: mọi worker (kể cả worker đã phát) nhận lại sự kiện và chuyển cho client của mình."""
+    channel = "edumanager:booking-events"
+
+    def __init__(self, url):
+        self.url = url
+        self.task = None
+
+    async def start(self, deliver):
+        import redis.asyncio as redis  # Chỉ cần khi bật backend Redis
+        self.client = redis.from_url(self.url)
+        self.pubsub = self.client.pubsub()
+        await self.pubsub.subscribe(self.channel)
+        self.task = asyncio.create_task(self._listen(deliver))
+
+    async def _listen(self, deliver):
+        async for message in self.pubsub.listen():
+            if message["type"] == "message": deliver(json_loads(message["data"]))
+
+    async def publish(self, event):
+        await self.client.publish(self.channel, json_dumps(event))
+
+    async def stop(self):
+        if self.task: self.task.cancel()
+        await self.pubsub.close()
+        await self.client.close()
+
+class EventSubscription:
+    def __init__(self, room_id, window_from, window_to, maxsize=100):
+        self.room_id = room_id
+        self.window_from = window_from
+        self.window_to = window_to
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def matches(self, event):
+        if self.room_id is not None and self.room_id not in event["room_ids"]: return False
+        if not event.get("from"): return True  # Sự kiện của phòng (bảo trì...) không gắn khung giờ
+        return parse_start_time(event["from"]) < self.window_to and parse_start_time(event["to"]) > self.window_from
+
+    def push(self, event):
+        if self.queue.full():
+            # Client đọc chậm: bỏ các sự kiện đang chờ, yêu cầu client tải lại cả khung giờ
+            while not self.queue.empty(): self.queue.get_nowait()
+            if event is not None: event = {"type": "resync"}
+        self.queue.put_nowait(event)
+
+class BookingEventBus:
+    def __init__(self, backend):
+        self.backend = backend
+        self.subscribers = set()
+        self.listeners = []  # Bộ nhớ đệm trong worker cần cập nhật theo mọi sự kiện (vd. chỉ mục phòng trống)
+        self.internal = {}  # Loại sự kiện -> handler: sự kiện nội bộ giữa các worker, không tới listeners/client
+
+    async def start(self):
+        await self.backend.start(self._deliver)
+
+    async def stop(self):
+        for sub in self.subscribers: sub.push(None)  # Kết thúc các stream đang mở
+        await self.backend.stop()
+
+    def subscribe(self, room_id, window_from, window_to):
+        sub = EventSubscription(room_id, window_from, window_to)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        self.subscribers.discard(sub)
+
+    async def publish(self, event):
+        # Lỗi phát sự kiện không được làm hỏng request đã commit
+        try: await self.backend.publish(event)
+        except Exception as e: print(f"Lỗi phát sự kiện lịch đặt: {e}")
+
+    def _deliver(self, event):
+        handler = self.internal.get(event["type"])
+        if handler: return handler(event)
+        for listener in self.listeners: listener(event)
+        for sub in list(self.subscribers):
+            if sub.matches(event): sub.push(event)
+
+booking_events = BookingEventBus(RedisEventBackend(BOOKING_EVENTS_URL) if BOOKING_EVENTS_URL.startswith("redis") else LocalEventBackend())
+
+def booking_event(event_type, booking):
+    d = booking_to_dict(booking)
+    return {"type": event_type, "booking": d, "room_ids": [booking.room_id], "from": d["start_at"], "to": d["end_at"]}
+
+def window_event(room_ids, starts, ends):
+    """Thay đổi hàng loạt: client đang xem các phòng/khung giờ này tự tải lại thay vì nhận từng lịch."""
+    return {"type": "refresh", "room_ids": sorted(set(room_ids)),
+            "from": min(starts).isoformat() + "Z", "to": max(ends).isoformat() + "Z"}
+
+def room_to_dict(r):
+    return {"id": r.id, "room_name": r.room_name, "capacity": r.capacity, "equipment": r.equipment, "status": r.status}
+
+# --- Chỉ mục phòng trống: lịch chưa kết thúc của từng phòng, sắp theo giờ bắt đầu, cập nhật theo sự kiện lịch đặt ---
+class AvailabilityIndex:
+    """Tìm phòng trống bằng bisect trên danh sách đã sắp xếp của từng phòng thay vì quét DB theo từng phòng.
+
+    Lịch trong cùng 1 phòng không chồng nhau (đặt lịch luôn khóa phòng khi check trùng), nên trong các lịch
+    bắt đầu trước 1 mốc, lịch kết thúc muộn nhất chính là lịch đứng ngay trước mốc đó.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.rooms = {}
+        self.slots = {}  # room_id -> ([start_at], [end_at], [booking_id])
+        self.horizon = None  # Chỉ giữ lịch kết thúc sau mốc này
+        self.loaded_at = 0.0
+        self.dirty_rooms = set()
+        self.lock = asyncio.Lock()
+
+    async def ensure_fresh(self, db):
+        async with self.lock:
+            if self.horizon is None or time.monotonic() - self.loaded_at > self.ttl: await self._load(db)
+            elif self.dirty_rooms: await self._load(db, self.dirty_rooms)
+
+    async def _load(self, db, room_ids=None):
+        # Sự kiện tới trong lúc đang nạp sẽ đánh dấu lại phòng vào dirty_rooms (xem apply)
+        self.dirty_rooms = set()
+        q = select(Booking.id, Booking.room_id, Booking.start_at, Booking.end_at)
+        if room_ids is None:
+            self.horizon = utc_now()
+            self.loaded_at = time.monotonic()
+            self.rooms = {r.id: room_to_dict(r) for r in await db.scalars(select(Classroom))}
+            self.slots = {}
+        else:
+            room_ids = set(room_ids)
+            q = q.where(Booking.room_id.in_(room_ids))
+            for room_id in room_ids: self.slots.pop(room_id, None)
+        rows = await db.execute(q.where(Booking.end_at > self.horizon).order_by(Booking.room_id, Booking.start_at))
+        for b in rows:
+            starts, ends, ids = self.slots.setdefault(b.room_id, ([], [], []))
+            starts.append(b.start_at); ends.append(b.end_at); ids.append(b.id)
+
+    def add(self, booking_id, room_id, start, end):
+        self.remove(booking_id, room_id)
+        starts, ends, ids = self.slots.setdefault(room_id, ([], [], []))
+        i = bisect.bisect_left(starts, start)
+        starts.insert(i, start); ends.insert(i, end); ids.insert(i, booking_id)
+
+    def remove(self, booking_id, room_id):
+        slot = self.slots.get(room_id)
+        if slot and booking_id in slot[2]:
+            i = slot[2].index(booking_id)
+            for column in slot: del column[i]
+
+    def is_free(self, room_id, start, end):
+        slot = self.slots.get(room_id)
+        if not slot: return True
+        starts, ends, _ = slot
+        i = bisect.bisect_left(starts, end)  # Các lịch [0, i) bắt đầu trước khi khung cần tìm kết thúc
+        return i == 0 or ends[i - 1] <= start
+
+    def apply(self, event):
+        if self.horizon is None: return  # Chưa nạp: lần tìm đầu tiên sẽ nạp đầy đủ
+        if self.lock.locked(): self.dirty_rooms.update(event.get("room_ids", ()))
+        kind = event["type"]
+        if kind in ("created", "approved", "deleted", "rejected"):
+            b = event["booking"]
+            if kind in ("deleted", "rejected"): self.remove(b["id"], b["room_id"])
+            elif b["start_at"] and b["end_at"]:
+                self.add(b["id"], b["room_id"], parse_start_time(b["start_at"]), parse_start_time(b["end_at"]))
+        elif kind == "room":
+            room = event["room"]
+            if room.get("deleted"):
+                self.rooms.pop(room["id"], None); self.slots.pop(room["id"], None)
+            else:
+                self.rooms[room["id"]] = room
+                if room["status"] == "Maintenance": self.slots.pop(room["id"], None)  # Bảo trì hủy hết lịch
+        elif kind == "refresh":
+            self.dirty_rooms.update(event["room_ids"])
+
+    def search(self, start, end, min_capacity=0, equipment=(), busy=None):
+        """Phòng Available đủ sức chứa, có đủ thiết bị và trống trong [start, end); busy: tập phòng bận nếu đã tự tra DB."""
+        found = []
+        for room_id, room in self.rooms.items():
+            if room["status"] != "Available" or (room["capacity"] or 0) < min_capacity: continue
+            have = (room["equipment"] or "").casefold()
+            if any(e not in have for e in equipment): continue
+            free = room_id not in busy if busy is not None else self.is_free(room_id, start, end)
+            if free: found.append(room)
+        return sorted(found, key=lambda r: (r["capacity"] or 0, r["room_name"] or ""))
+
+availability_index = AvailabilityIndex(AVAILABILITY_INDEX_TTL)
+booking_events.listeners.append(availability_index.apply)
+
+# --- Số liệu dashboard: bộ đếm + danh sách vòng các lịch mới nhất, cập nhật theo sự kiện lịch đặt ---
+class DashboardStats:
+    """Thay cho việc đếm/quét toàn bảng mỗi lần mở dashboard.
+
+    Sự kiện lẻ được cộng trừ tại chỗ. Sự kiện không đủ chi tiết (thao tác hàng loạt, bảo trì hủy lịch, xóa lịch
+    đang nằm trong danh sách gần nhất) chỉ đánh dấu cần nạp lại; lần mở dashboard kế tiếp nạp lại bằng 3 truy vấn gộp.
+    """
+    def __init__(self, ttl, feed_size=10):
+        self.ttl = ttl
+        self.room_status = {}
+        self.room_names = {}
+        self.active_rooms = 0
+        self.total_bookings = 0
+        self.user_bookings = {}
+        self.recent = deque(maxlen=feed_size)
+        self.loaded_at = None
+        self.lock = asyncio.Lock()
+
+    async def ensure_fresh(self, db):
+        async with self.lock:
+            if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl: await self._load(db)
+
+    async def _load(self, db):
+        # Đặt mốc trước khi truy vấn: sự kiện tới giữa chừng sẽ xóa mốc (xem apply) để lần sau nạp lại
+        self.loaded_at = time.monotonic()
+        rooms = (await db.execute(select(Classroom.id, Classroom.room_name, Classroom.status))).all()
+        self.room_status = {r.id: r.status for r in rooms}
+        self.room_names = {r.id: r.room_name for r in rooms}
+        self.active_rooms = sum(1 for r in rooms if r.status == 'Available')
+        # Tổng lượt đặt tính cả lịch đã lưu trữ: job lưu trữ chỉ chuyển tầng, không làm đổi con số
+        ids = union_tiers(booking_tiers(None), lambda t: select(t.c.user_id, t.c.id))
+        counts = await db.execute(select(ids.c.user_id, func.count(ids.c.id)).group_by(ids.c.user_id))
+        self.user_bookings = {user_id: n for user_id, n in counts}
+        self.total_bookings = sum(self.user_bookings.values())
+        latest = await db.scalars(select(Booking).order_by(Booking.id.desc()).limit(self.recent.maxlen))
+        self.recent = deque((booking_to_dict(b) for b in latest), maxlen=self.recent.maxlen)
+
+    def apply(self, event):
+        if self.loaded_at is None: return
+        if self.lock.locked(): self.loaded_at = None; return
+        kind = event["type"]
+        if kind == "created":
+            b = event["booking"]
+            self.total_bookings += 1
+            self.user_bookings[b["user_id"]] = self.user_bookings.get(b["user_id"], 0) + 1
+            self.recent.appendleft(dict(b))
+        elif kind in ("deleted", "rejected"):
+            b = event["booking"]
+            self.total_bookings -= 1
+            self.user_bookings[b["user_id"]] = self.user_bookings.get(b["user_id"], 1) - 1
+            if any(item["id"] == b["id"] for item in self.recent): self.loaded_at = None  # Cần lấy lịch thứ 11 bù vào
+        elif kind == "approved":
+            for item in self.recent:
+                if item["id"] == event["booking"]["id"]: item["status"] = event["booking"]["status"]
+        elif kind == "room":
+            room = event["room"]
+            old = self.room_status.pop(room["id"], None)
+            self.room_names.pop(room["id"], None)
+            if old == 'Available': self.active_rooms -= 1
+            if not room.get("deleted"):
+                self.room_status[room["id"]] = room["status"]
+                self.room_names[room["id"]] = room["room_name"]
+                if room["status"] == 'Available': self.active_rooms += 1
+                if room["status"] == 'Maintenance': self.loaded_at = None  # Bảo trì đã hủy lịch của phòng
+        elif kind == "refresh":
+            self.loaded_at = None
+
+    def view(self, user):
+        return {
+            "total_rooms": len(self.room_status), "active_rooms": self.active_rooms,
+            "booking_count": self.total_bookings if user.role == 'admin' else self.user_bookings.get(user.id, 0),
+            "history": [{
+                "booker": b["booker_name"], "room_name": self.room_names.get(b["room_id"], "Unknown"),
+                "time": b["start_time"], "duration": b["duration_hours"], "status": b["status"]
+            } for b in self.recent],
+        }
+
+dashboard_stats = DashboardStats(DASHBOARD_STATS_TTL)
+booking_events.listeners.append(dashboard_stats.apply)
+
+# --- Cache TTL + LRU trong bộ nhớ ---
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+
+    def get(self, key):
+        item = self.data.get(key)
+        if item is None: return None
+        expires, value = item
+        if expires < time.monotonic():
+            self.data.pop(key, None)
+            return None
+        self.data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self.data[key] = (time.monotonic() + self.ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize: self.data.popitem(last=False)
+
+    def pop(self, key):
+        self.data.pop(key, None)
+
+# --- Phiên đăng nhập ký HMAC: cookie mang user id + role, không cần tra DB theo username ---
+def _sign(payload):
+    return hmac.new(SESSION_SECRET.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+def create_session_token(user):
+    raw = f"{user.id}|{user.role}|{int(time.time()) + SESSION_MAX_AGE}"
+    payload = base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+    return f"{payload}.{_sign(payload)}"
+
+def read_session_token(token):
+    """Trả về (user_id, role) nếu token hợp lệ và chưa hết hạn, ngược lại None."""
     try:
-        server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-        server.login(SENDER_EMAIL, SENDER_PASSWORD)
-        server.sendmail(SENDER_EMAIL, receiver_email, msg.as_string())
-        server.quit()
-        return verification_code
-    except Exception as e:
-        print(f"Lỗi gửi email: {e}")
-        return None
+        payload, sig = token.split(".")
+        if not hmac.compare_digest(sig, _sign(payload)): return None
+        user_id, role, expires = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)).decode().split("|")
+        if int(expires) < time.time(): return None
+        return int(user_id), role
+    except (AttributeError, ValueError): return None
+
+# Cache bản ghi User theo id; bị xóa khi User đổi/xóa (xem sự kiện session bên dưới)
+user_cache = TTLCache(maxsize=4096, ttl=USER_CACHE_TTL)
+
+def user_changed_event(user_id):
+    """Phát sau khi commit thay đổi User: mọi worker (qua backend Redis) bỏ bản cache của user đó."""
+    return {"type": "user", "user_id": user_id}
+
+booking_events.internal["user"] = lambda event: user_cache.pop(event["user_id"])
+
+def _user_snapshot(user):
+    return {c.name: getattr(user, c.name) for c in User.__table__.columns}
+
+def _user_from_cache(db, user_id):
+    key = db.identity_key(User, user_id)
+    if key in db.identity_map: return db.identity_map[key]
+    snapshot = user_cache.get(user_id)
+    if snapshot is None: return None
+    # Gắn lại bản sao vào session hiện tại (không phát sinh truy vấn), handler vẫn sửa + commit được
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    db.add(user)
+    return user
+
+@event.listens_for(AppSession, "after_flush")
+def _collect_changed_users(session, flush_context):
+    changed = session.info.setdefault("changed_user_ids", set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            changed.add(obj.id)
+            user_cache.pop(obj.id)
+
+@event.listens_for(AppSession, "after_commit")
+def _invalidate_user_cache(session):
+    for user_id in session.info.pop("changed_user_ids", ()): user_cache.pop(user_id)
 
 # --- Hàm Xác thực & Phân quyền ---
-def get_current_user(request: Request, db: Session = Depends(get_db)):
-    username = request.cookies.get("current_user")
-    if not username: return None
-    return db.query(User).filter(User.username == username).first()
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)):
+    # Mỗi request chỉ xác định user 1 lần
+    if hasattr(request.state, "user"): return request.state.user
+    user = None
+    session = read_session_token(request.cookies.get(SESSION_COOKIE))
+    if session:
+        user_id, role = session
+        user = _user_from_cache(db, user_id)
+        if user is None:
+            user = await db.get(User, user_id)
+            if user: user_cache.set(user_id, _user_snapshot(user))
+        # Quyền đã bị đổi sau khi đăng nhập -> phiên hết hiệu lực
+        if user and user.role != role: user = None
+    request.state.user = user
+    return user
 
-def require_admin(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def require_admin(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user or user.role != "admin":
         raise HTTPException(status_code=403, detail="Chỉ Admin mới có quyền này.")
     return user
 
-def require_staff(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def require_staff(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user or user.role not in ["admin", "teacher"]:
         raise HTTPException(status_code=403, detail="Chỉ Giáo viên hoặc Admin mới có quyền này.")
     return user
 
+# --- Xuất dữ liệu: CSV / iCalendar ---
+def export_window(request):
+    """Khung from/to tùy chọn của các API xuất dữ liệu; thiếu thì không giới hạn phía đó."""
+    bounds = [request.query_params.get(k) for k in ("from", "to")]
+    return tuple(parse_start_time(v) if v else None for v in bounds)
+
+def window_filter(t, window_from, window_to, room_id=None):
+    criteria = []
+    if window_to is not None: criteria.append(t.c.start_at < window_to)
+    if window_from is not None: criteria.append(t.c.end_at > window_from)
+    if room_id is not None: criteria.append(t.c.room_id == room_id)
+    return criteria
+
+def csv_safe(value):
+    """Ô bắt đầu bằng = + - @ tab CR bị Excel chạy như công thức (CSV injection): thêm ' phía trước."""
+    return "'" + value if isinstance(value, str) and value.startswith(("=", "+", "-", "@", "\t", "\r")) else value
+
+def ics_text(value):
+    return str(value or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def ics_line(name, value):
+    """1 dòng iCalendar, gấp ở 75 byte theo RFC 5545 (không cắt giữa 1 ký tự UTF-8)."""
+    line, chunks = f"{name}:{value}".encode(), []
+    while len(line) > 75:
+        cut = 75 if not chunks else 74  # Dòng nối bắt đầu bằng 1 dấu cách
+        while (line[cut] & 0xC0) == 0x80: cut -= 1
+        chunks.append(line[:cut]); line = line[cut:]
+    chunks.append(line)
+    return b"\r\n ".join(chunks).decode() + "\r\n"
+
+def ics_time(dt):
+    return dt.strftime("%Y%m%dT%H%M%SZ")
+
+def ics_event(b, room_name, stamp):
+    return "".join([
+        "BEGIN:VEVENT\r\n", ics_line("UID", f"booking-{b.id}@edumanager"), ics_line("DTSTAMP", stamp),
+        ics_line("DTSTART", ics_time(b.start_at)), ics_line("DTEND", ics_time(b.end_at)),
+        ics_line("SUMMARY", ics_text(f"{room_name} - {b.booker_name}")),
+        ics_line("DESCRIPTION", ics_text(f"Thời lượng: {b.duration_hours}, trạng thái: {b.status}")),
+        ics_line("STATUS", "CONFIRMED" if b.status == "Confirmed" else "TENTATIVE"), "END:VEVENT\r\n",
+    ])
+
+# --- Báo cáo công suất phòng: giờ đã đặt theo phòng/ngày/tuần + heatmap khung giờ cao điểm ---
+LOCAL_UTC_OFFSET = timedelta(hours=7)  # Báo cáo chia ngày theo giờ Việt Nam
+REPORT_SLOT_MINUTES = 30
+
+class UtilizationAggregator:
+    """Cộng dồn 1 lượt trên các khoảng start_at/end_at đã chuẩn hóa, không giữ lại từng lịch."""
+    def __init__(self, window_from, window_to, granularity):
+        self.window_from = window_from
+        self.window_to = window_to
+        self.granularity = granularity
+        self.hours = {}  # room_id -> {kỳ: số giờ}
+        self.heatmap = [[0] * (24 * 60 // REPORT_SLOT_MINUTES) for _ in range(7)]  # [thứ][khung 30 phút] -> số lịch
+        self.bookings = 0
+
+    def period(self, day):
+        return (day if self.granularity == "day" else day - timedelta(days=day.weekday())).isoformat()
+
+    def add(self, room_id, start, end):
+        start, end = max(start, self.window_from) + LOCAL_UTC_OFFSET, min(end, self.window_to) + LOCAL_UTC_OFFSET
+        if end <= start: return
+        self.bookings += 1
+        per_room = self.hours.setdefault(room_id, {})
+        while start < end:  # Lịch qua nửa đêm được cắt theo ranh giới ngày
+            midnight = datetime(start.year, start.month, start.day)
+            seg_end = min(end, midnight + timedelta(days=1))
+            key = self.period(midnight.date())
+            per_room[key] = per_room.get(key, 0.0) + (seg_end - start).total_seconds() / 3600
+            row = self.heatmap[midnight.weekday()]
+            first = int((start - midnight).total_seconds() // 60 // REPORT_SLOT_MINUTES)
+            last = -int(-(seg_end - midnight).total_seconds() // 60 // REPORT_SLOT_MINUTES)
+            for slot in range(first, last): row[slot] += 1
+            start = seg_end
+
+    def result(self, room_names):
+        days = (self.window_to - self.window_from).total_seconds() / 86400
+        rooms = []
+        for room_id in sorted(set(room_names) | set(self.hours), key=lambda x: (x is None, x or 0)):
+            periods = self.hours.get(room_id, {})
+            total = sum(periods.values())
+            rooms.append({
+                "room_id": room_id, "room_name": room_names.get(room_id, "Unknown"), "booked_hours": round(total, 2),
+                "utilization": round(total / (days * UTILIZATION_DAY_HOURS), 4),
+                "periods": {k: round(v, 2) for k, v in sorted(periods.items())},
+            })
+        peaks = sorted(((n, wd, slot) for wd, row in enumerate(self.heatmap) for slot, n in enumerate(row) if n), reverse=True)[:10]
+        return {
+            "status": "success", "granularity": self.granularity, "bookings": self.bookings,
+            "from": self.window_from.isoformat() + "Z", "to": self.window_to.isoformat() + "Z",
+            "rooms": rooms, "heatmap": self.heatmap, "slot_minutes": REPORT_SLOT_MINUTES,
+            "peak_slots": [{"weekday": wd, "slot": f"{slot * REPORT_SLOT_MINUTES // 60:02d}:{slot * REPORT_SLOT_MINUTES % 60:02d}",
+                            "bookings": n} for n, wd, slot in peaks],
+        }
+
+class UtilizationReports:
+    """Báo cáo được cache theo (kỳ, phòng); sự kiện lịch đặt giao với kỳ nào thì bỏ cache của kỳ đó."""
+    def __init__(self, ttl):
+        self.cache = TTLCache(maxsize=128, ttl=ttl)
+        self.generation = 0
+
+    async def get(self, db, window_from, window_to, granularity, room_id=None):
+        key = (window_from, window_to, granularity, room_id)
+        report = self.cache.get(key)
+        if report is None:
+            generation = self.generation
+            report = await self._compute(db, *key)
+            if generation == self.generation: self.cache.set(key, report)  # Có thay đổi trong lúc tính thì không cache
+        return report
+
+    async def _compute(self, db, window_from, window_to, granularity, room_id):
+        agg = UtilizationAggregator(window_from, window_to, granularity)
+        b = union_tiers(booking_tiers(window_from), lambda t: select(t.c.room_id, t.c.start_at, t.c.end_at)
+                        .where(*window_filter(t, window_from, window_to, room_id)))
+        result = await db.stream(select(b).execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for partition in result.partitions():
+            for r in partition: agg.add(r.room_id, r.start_at, r.end_at)
+        q = select(Classroom.id, Classroom.room_name)
+        if room_id is not None: q = q.where(Classroom.id == room_id)
+        return agg.result({r.id: r.room_name for r in await db.execute(q)})
+
+    def apply(self, event):
+        self.generation += 1
+        if not event.get("from"):  # Sự kiện phòng (đổi tên, xóa, bảo trì hủy lịch): bỏ hết
+            self.cache.data.clear()
+            return
+        start, end = parse_start_time(event["from"]), parse_start_time(event["to"])
+        for key in [k for k in self.cache.data if k[0] < end and k[1] > start]: self.cache.pop(key)
+
+utilization_reports = UtilizationReports(REPORT_CACHE_TTL)
+booking_events.listeners.append(utilization_reports.apply)
+
 # ============================================================
 # 4. API GROUP: XÁC THỰC (LOGIN / REGISTER / FORGOT PASS)
 # ============================================================
 
 @app.post("/api/login")
-async def login(data: dict, response: Response, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == data['username'], User.password == data['password']).first()
+async def login(data: dict, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    blocked = await rate_limit(request, "login", data.get('username'))
+    if blocked: return blocked
+    user = await db.scalar(select(User).where(User.username == data['username'], User.password == data['password']))
     if user:
-        response.set_cookie(key="current_user", value=user.username)
+        response.set_cookie(key=SESSION_COOKIE, value=create_session_token(user),
+                            max_age=SESSION_MAX_AGE, httponly=True, samesite="lax")
         return {"status": "success"}
     return {"status": "error", "message": "Sai tài khoản hoặc mật khẩu"}
 
 @app.post("/api/register/send-otp")
-async def register_send_otp(data: dict, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.username == data['username']).first():
+async def register_send_otp(data: dict, request: Request, db: AsyncSession = Depends(get_db)):
+    blocked = await rate_limit(request, "otp", data.get('email'))
+    if blocked: return blocked
+    if await db.scalar(select(User.id).where(User.username == data['username'])):
         return {"status": "error", "message": "Tên đăng nhập đã tồn tại!"}
-    if db.query(User).filter(User.email == data['email']).first():
+    if await db.scalar(select(User.id).where(User.email == data['email'])):
         return {"status": "error", "message": "Email này đã được sử dụng!"}
 
     otp = send_verification_email(data['email'])
     if not otp: return {"status": "error", "message": "Lỗi gửi mail. Hãy kiểm tra lại Email!"}
-    return {"status": "success", "message": "Đã gửi mã!", "server_otp": otp}
+    await otp_store.issue("register", data['email'].strip().lower(), otp)
+    return {"status": "success", "message": "Đã gửi mã!"}
 
 @app.post("/api/register/confirm")
-async def register_confirm(data: dict, db: Session = Depends(get_db)):
+async def register_confirm(data: dict, db: AsyncSession = Depends(get_db)):
     # 1. Check trùng Username
-    if db.query(User).filter(User.username == data['username']).first():
+    if await db.scalar(select(User.id).where(User.username == data['username'])):
         return {"status": "error", "message": "Tên đăng nhập này đã có người sử dụng!"}
     
     # 2. Check trùng Họ tên
-    if db.query(User).filter(User.full_name == data['full_name']).first():
+    if await db.scalar(select(User.id).where(User.full_name == data['full_name']).limit(1)):
         return {"status": "error", "message": "Họ và tên này đã tồn tại! Vui lòng thêm ký tự phân biệt."}
 
     # 3. Check Mật khẩu mạnh
@@ -161,38 +1662,42 @@ async def register_confirm(data: dict, db: Session = Depends(get_db)):
     if not re.search(r"[!@#$%^&*(),.?\":{}|<>]", password):
         return {"status": "error", "message": "Mật khẩu phải có ít nhất 1 ký tự đặc biệt!"}
 
+    # 4. Check mã OTP đã gửi tới email (kiểm tra ở server, không gửi mã về trình duyệt)
+    if not await otp_store.verify("register", data['email'].strip().lower(), data.get('otp')):
+        return {"status": "error", "message": "Mã OTP không đúng hoặc đã hết hạn!"}
+
     new_user = User(
         username=data['username'], password=data['password'], 
         email=data['email'], phone=data['phone'], 
         role=data['role'], full_name=data['full_name']
     )
     db.add(new_user)
-    db.commit()
+    await db.commit()
     return {"status": "success", "message": "Đăng ký thành công!"}
 
 @app.post("/api/forgot/send-otp")
-async def forgot_send_otp(data: dict, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == data['username']).first()
+async def forgot_send_otp(data: dict, request: Request, db: AsyncSession = Depends(get_db)):
+    blocked = await rate_limit(request, "otp", data.get('username'))
+    if blocked: return blocked
+    user = await db.scalar(select(User).where(User.username == data['username']))
     if not user: return {"status": "error", "message": "User không tồn tại"}
     
     otp = send_verification_email(user.email)
     if not otp: return {"status": "error", "message": "Lỗi gửi mail"}
     
-    user.verification_code = otp
-    db.commit()
+    await otp_store.issue("forgot", user.id, otp)
     hidden_email = user.email[:3] + "****" + user.email.split('@')[1]
     return {"status": "success", "message": f"Đã gửi mã tới {hidden_email}"}
 
 @app.post("/api/forgot/reset")
-async def forgot_reset(data: dict, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == data['username']).first()
+async def forgot_reset(data: dict, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.username == data['username']))
     if not user: return {"status": "error", "message": "User không tồn tại"}
-    if user.verification_code != data['otp']:
-        return {"status": "error", "message": "Sai mã OTP!"}
+    if not await otp_store.verify("forgot", user.id, data['otp']):
+        return {"status": "error", "message": "Sai mã OTP hoặc mã đã hết hạn!"}
     
     user.password = data['new_password']
-    user.verification_code = None
-    db.commit()
+    await db.commit()
     return {"status": "success", "message": "Đổi mật khẩu thành công!"}
 
 # ============================================================
@@ -200,19 +1705,21 @@ async def forgot_reset(data: dict, db: Session = Depends(get_db)):
 # ============================================================
 
 @app.post("/api/profile/send-otp")
-async def profile_send_otp(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def profile_send_otp(request: Request, db: AsyncSession = Depends(get_db)):
+    session = read_session_token(request.cookies.get(SESSION_COOKIE))
+    blocked = await rate_limit(request, "otp", f"user:{session[0]}" if session else None)
+    if blocked: return blocked
+    user = await get_current_user(request, db)
     if not user: return {"status": "error", "message": "Chưa đăng nhập!"}
     
     otp = send_verification_email(user.email)
     if not otp: return {"status": "error", "message": "Không thể gửi email."}
     
-    user.verification_code = otp
-    db.commit()
+    await otp_store.issue("profile", user.id, otp)
     return {"status": "success", "message": "Đã gửi mã xác thực."}
 
 @app.post("/api/profile/update")
-async def update_profile(data: dict, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def update_profile(data: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if not current_user: return {"status": "error", "message": "Chưa đăng nhập!"}
     
     new_email = data.get('email')
@@ -222,27 +1729,27 @@ async def update_profile(data: dict, db: Session = Depends(get_db), current_user
     if is_sensitive:
         otp_input = data.get('otp')
         if not otp_input: return {"status": "require_otp", "message": "Cần xác thực OTP"}
-        if current_user.verification_code != otp_input:
-            return {"status": "error", "message": "Mã OTP không đúng!"}
-        current_user.verification_code = None
+        if not await otp_store.verify("profile", current_user.id, otp_input):
+            return {"status": "error", "message": "Mã OTP không đúng hoặc đã hết hạn!"}
 
     if new_email: current_user.email = new_email
     if new_phone: current_user.phone = new_phone
     
-    db.commit()
+    await db.commit()
+    await booking_events.publish(user_changed_event(current_user.id))
     return {"status": "success", "message": "Cập nhật thành công!"}
 
 @app.post("/api/profile/change-password")
-async def profile_change_pass(data: dict, request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def profile_change_pass(data: dict, request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request, db)
     if not user: return {"status": "error", "message": "Chưa đăng nhập!"}
 
-    if user.verification_code != data['otp']:
-        return {"status": "error", "message": "Mã xác thực không đúng!"}
+    if not await otp_store.verify("profile", user.id, data['otp']):
+        return {"status": "error", "message": "Mã xác thực không đúng hoặc đã hết hạn!"}
     
     user.password = data['new_password']
-    user.verification_code = None 
-    db.commit()
+    await db.commit()
+    await booking_events.publish(user_changed_event(user.id))
     return {"status": "success", "message": "Cập nhật mật khẩu thành công!"}
 
 # ============================================================
@@ -250,252 +1757,596 @@ async def profile_change_pass(data: dict, request: Request, db: Session = Depend
 # ============================================================
 
 @app.post("/api/rooms/create")
-async def create_room(data: dict, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
+async def create_room(data: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
     status_input = data.get('status', 'Available') 
-    db.add(Classroom(
+    r = Classroom(
         room_name=data['room_name'], capacity=data['capacity'], 
         equipment=data['equipment'], status=status_input
-    ))
-    db.commit()
+    )
+    db.add(r)
+    await db.commit()
+    await booking_events.publish({"type": "room", "room": room_to_dict(r), "room_ids": [r.id]})
     return {"status": "success"}
 
 @app.post("/api/rooms/update")
-async def update_room(data: dict, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
-    r = db.query(Classroom).filter(Classroom.id == data['room_id']).first()
+async def update_room(data: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    # Khóa phòng để không có lịch mới chen vào giữa lúc hủy lịch do bảo trì
+    await lock_rooms(db, [data['room_id']])
+    r = await db.get(Classroom, data['room_id'])
     if not r: return {"status": "error", "message": "Không tìm thấy phòng!"}
 
     new_status = data.get('status')
     
-    # Nếu chuyển sang Bảo trì -> Xóa hết lịch đặt
+    # Nếu chuyển sang Bảo trì -> Hủy các lịch chưa bắt đầu, lịch đã qua giữ lại làm lịch sử
     if new_status == 'Maintenance':
-        deleted_count = db.query(Booking).filter(Booking.room_id == r.id).delete()
-        print(f"Đã hủy {deleted_count} lịch do bảo trì.")
+        deleted_count = (await db.execute(delete(Booking).where(Booking.room_id == r.id, Booking.start_at > utc_now()))).rowcount
+        # Lịch đã qua mốc lưu trữ chuyển luôn sang kho; lịch vừa kết thúc/đang diễn ra để job lưu trữ chuyển sau
+        archived_count = await archive_bookings(db, Booking.room_id == r.id, Booking.end_at < archive_cutoff())
+        print(f"Đã hủy {deleted_count} lịch sắp tới, lưu trữ {archived_count} lịch đã qua do bảo trì.")
 
     r.room_name = data.get('room_name', r.room_name)
     r.capacity = data.get('capacity', r.capacity)
     r.equipment = data.get('equipment', r.equipment)
     r.status = new_status
     
-    db.commit()
-    msg = "Đã chuyển sang bảo trì và hủy các lịch đặt!" if new_status == 'Maintenance' else "Cập nhật thành công!"
+    await db.commit()
+    await booking_events.publish({"type": "room", "room": room_to_dict(r), "room_ids": [r.id]})
+    msg = "Đã chuyển sang bảo trì và hủy các lịch sắp tới!" if new_status == 'Maintenance' else "Cập nhật thành công!"
     return {"status": "success", "message": msg}
 
 @app.post("/api/rooms/delete")
-async def delete_room(data: dict, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
-    r = db.query(Classroom).filter(Classroom.id == data['room_id']).first()
-    if r: db.delete(r); db.commit(); return {"status": "success"}
-    return {"status": "error"}
+async def delete_room(data: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    r = await db.get(Classroom, data['room_id'])
+    if not r: return {"status": "error"}
+    await db.delete(r)
+    await db.execute(update(BookingArchive).where(BookingArchive.room_id == r.id).values(room_id=None))
+    await db.commit()
+    await booking_events.publish({"type": "room", "room": {"id": r.id, "deleted": True}, "room_ids": [r.id]})
+    return {"status": "success"}
+
+@app.get("/api/rooms/available")
+async def available_rooms(request: Request, db: AsyncSession = Depends(get_db), min_capacity: int = 0, equipment: str = ""):
+    if not await get_current_user(request, db): raise HTTPException(status_code=401, detail="Chưa đăng nhập!")
+    try:
+        start = parse_start_time(request.query_params['start'])
+        end = parse_start_time(request.query_params['end'])
+    except (KeyError, ValueError): raise HTTPException(status_code=400, detail="Tham số start/end không hợp lệ!")
+    if end <= start: raise HTTPException(status_code=400, detail="end phải sau start!")
+    wanted = [e.strip().casefold() for e in equipment.split(",") if e.strip()]
+
+    await availability_index.ensure_fresh(db)
+    busy = None
+    if start < availability_index.horizon:
+        # Khung giờ đã qua không nằm trong chỉ mục -> hỏi DB 1 lần các phòng bận trong khung (cả bookings_archive)
+        b = union_tiers(booking_tiers(start), lambda t: select(t.c.room_id).where(*overlaps(t, start, end)).distinct())
+        busy = set(await db.scalars(select(b.c.room_id)))
+    rooms = availability_index.search(start, end, min_capacity, wanted, busy)
+    return {"status": "success", "rooms": rooms, "count": len(rooms)}
 
 # ============================================================
 # 7. API GROUP: ĐẶT LỊCH & DUYỆT LỊCH
 # ============================================================
 
+@app.get("/api/bookings")
+async def list_bookings(request: Request, db: AsyncSession = Depends(get_db),
+                        room_id: int = None, cursor: str = None, limit: int = 500):
+    if not await get_current_user(request, db): raise HTTPException(status_code=401, detail="Chưa đăng nhập!")
+    # Chỉ trả về các lịch giao với khung thời gian đang xem [from, to)
+    try:
+        window_from = parse_start_time(request.query_params['from'])
+        window_to = parse_start_time(request.query_params['to'])
+        after = decode_cursor(cursor) if cursor else None
+    except (KeyError, ValueError): raise HTTPException(status_code=400, detail="Tham số from/to/cursor không hợp lệ!")
+    limit = max(1, min(limit, 1000))
+
+    def window(t):
+        q = select(*(t.c[n] for n in BOOKING_COLUMNS)).where(*overlaps(t, window_from, window_to))
+        if room_id is not None: q = q.where(t.c.room_id == room_id)
+        if after: q = q.where(or_(t.c.start_at > after[0], and_(t.c.start_at == after[0], t.c.id > after[1])))
+        return q
+    # Khung giờ đã qua mốc lưu trữ đọc thêm bookings_archive, khung hiện tại/tương lai chỉ chạm bảng nóng
+    b = union_tiers(booking_tiers(window_from), window)
+    rows = (await db.execute(select(b).order_by(b.c.start_at, b.c.id).limit(limit + 1))).all()
+
+    page = rows[:limit]
+    next_cursor = encode_cursor(page[-1].start_at, page[-1].id) if len(rows) > limit else None
+    body = json_dumps({"status": "success", "bookings": [booking_to_dict(b) for b in page], "next_cursor": next_cursor})
+
+    etag = 'W/"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag): return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/api/bookings/stream")
+async def stream_bookings(request: Request, room_id: int = None):
+    if lifecycle.draining: raise HTTPException(status_code=503, detail="Máy chủ đang tắt, hãy kết nối lại!")
+    # Phiên DB chỉ dùng để xác thực rồi đóng ngay, không giữ kết nối suốt thời gian stream
+    async with AsyncSessionLocal() as db:
+        if not await get_current_user(request, db): raise HTTPException(status_code=401, detail="Chưa đăng nhập!")
+    try:
+        window_from = parse_start_time(request.query_params['from'])
+        window_to = parse_start_time(request.query_params['to'])
+    except (KeyError, ValueError): raise HTTPException(status_code=400, detail="Tham số from/to không hợp lệ!")
+
+    sub = booking_events.subscribe(room_id, window_from, window_to)
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try: event = await asyncio.wait_for(sub.queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"  # Giữ kết nối qua proxy
+                    continue
+                if event is None: break
+                yield f"event: {event['type']}\ndata: {json_dumps(event)}\n\n"
+        finally:
+            booking_events.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/api/bookings/create")
-async def create_booking(data: dict, db: Session = Depends(get_db), current_user: User = Depends(require_staff)):
-    # 1. Kiểm tra phòng
-    room = db.query(Classroom).filter(Classroom.id == data['room_id']).first()
+async def create_booking(data: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_staff)):
+    # 1. Xử lý thời gian
+    try:
+        req_start, req_end = booking_interval(data['start_time'], data['duration_display'], strict=True)
+    except Exception as e: return {"status": "error", "message": f"Lỗi định dạng thời gian hoặc thời lượng (tối đa {MAX_BOOKING_HOURS} giờ)!"}
+
+    # 2. Khóa phòng rồi mới kiểm tra: 2 người đặt cùng lúc sẽ check + lưu lần lượt, không thể cùng lọt qua
+    await lock_rooms(db, [data['room_id']])
+    room = await db.get(Classroom, data['room_id'])
     if not room: return {"status": "error", "message": "Phòng không tồn tại!"}
     if room.status == 'Maintenance': return {"status": "error", "message": "Phòng đang bảo trì!"}
 
-    # 2. Xử lý thời gian
-    try:
-        req_start = datetime.fromisoformat(data['start_time'].replace('Z', '+00:00'))
-        duration_text = data['duration_display']
-        req_hours = 0.0
-        if "Giờ" in duration_text:
-            parts = duration_text.split(" Giờ")
-            req_hours += int(parts[0])
-            if "Phút" in parts[1]: req_hours += 0.5
-        elif "Phút" in duration_text: req_hours = 0.5
-        else: req_hours = 1.0 
-        req_end = req_start + timedelta(hours=req_hours)
-    except Exception as e: return {"status": "error", "message": "Lỗi định dạng thời gian!"}
-
-    # 3. Check trùng lịch
-    existing_bookings = db.query(Booking).filter(Booking.room_id == data['room_id']).all()
-    for b in existing_bookings:
-        try:
-            b_start = datetime.fromisoformat(b.start_time.replace('Z', '+00:00'))
-            b_dur_text = b.duration_hours
-            b_hours = 0.0
-            if "Giờ" in b_dur_text:
-                parts = b_dur_text.split(" Giờ")
-                b_hours += int(parts[0])
-                if "Phút" in parts[1]: b_hours += 0.5
-            elif "Phút" in b_dur_text: b_hours = 0.5
-            else: b_hours = float(b_dur_text) if b_dur_text else 1.0
-            b_end = b_start + timedelta(hours=b_hours)
-            
-            # Logic trùng
-            if req_start < b_end and req_end > b_start:
-                vn_start = b_start + timedelta(hours=7)
-                vn_end = b_end + timedelta(hours=7)
-                conflict_msg = f"Bị trùng! Đã có lịch của {b.booker_name} ({vn_start.strftime('%H:%M')} - {vn_end.strftime('%H:%M')})"
-                return {"status": "error", "message": conflict_msg}
-        except Exception: continue 
+    # 3. Check trùng lịch (1 truy vấn theo index room_id + khoảng thời gian, đặt vào quá khứ thì xét cả kho lưu trữ)
+    overlapping = union_tiers(booking_tiers(req_start), lambda t: select(t.c.booker_name, t.c.start_at, t.c.end_at).where(
+        t.c.room_id == data['room_id'], *overlaps(t, req_start, req_end)))
+    b = (await db.execute(select(overlapping).limit(1))).first()
+    if b: return {"status": "error", "message": conflict_message(b)}
 
     # 4. Lưu lịch (Pending)
     booker_display = current_user.full_name if current_user.full_name else current_user.username
     new_booking = Booking(
         room_id=data['room_id'], user_id=current_user.id, booker_name=booker_display, 
         start_time=data['start_time'], duration_hours=data['duration_display'], 
+        start_at=req_start, end_at=req_end,
         status="Pending" # <--- Lịch mới luôn là Pending
     )
     db.add(new_booking)
-    db.commit()
-    return {"status": "success", "message": "Đặt phòng thành công (Chờ duyệt)!"}
+    await db.commit()  # Nhả khóa phòng
+    await booking_events.publish(booking_event("created", new_booking))
+    return {"status": "success", "message": "Đặt phòng thành công (Chờ duyệt)!", "booking_id": new_booking.id}
 
 @app.post("/api/bookings/delete")
-async def delete_booking(data: dict, db: Session = Depends(get_db), current_user: User = Depends(require_staff)):
-    bk = db.query(Booking).filter(Booking.id == data['booking_id']).first()
+async def delete_booking(data: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_staff)):
+    bk = await db.get(Booking, data['booking_id'])
     if not bk: return {"status": "error", "message": "Lỗi"}
     if current_user.role != 'admin' and bk.user_id != current_user.id: 
         return {"status": "error", "message": "Không có quyền"}
-    db.delete(bk)
-    db.commit()
+    await db.delete(bk)
+    await db.commit()
+    await booking_events.publish(booking_event("deleted", bk))
     return {"status": "success"}
 
 @app.post("/api/bookings/approve")
-async def approve_booking(data: dict, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
-    bk = db.query(Booking).filter(Booking.id == data['booking_id']).first()
+async def approve_booking(data: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    bk = await db.get(Booking, data['booking_id'])
     if not bk: return {"status": "error", "message": "Không tìm thấy lịch!"}
     bk.status = "Confirmed"
-    db.commit()
+    await db.commit()
+    await booking_events.publish(booking_event("approved", bk))
     return {"status": "success", "message": "Đã duyệt lịch!"}
 
 @app.post("/api/bookings/reject")
-async def reject_booking(data: dict, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
-    bk = db.query(Booking).filter(Booking.id == data['booking_id']).first()
+async def reject_booking(data: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    bk = await db.get(Booking, data['booking_id'])
     if not bk: return {"status": "error", "message": "Không tìm thấy lịch!"}
-    db.delete(bk)
-    db.commit()
+    await db.delete(bk)
+    await db.commit()
+    await booking_events.publish(booking_event("rejected", bk))
     return {"status": "success", "message": "Đã từ chối và hủy lịch!"}
 
+@app.post("/api/bookings/bulk")
+async def bulk_create_bookings(data: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_staff)):
+    try: items = expand_bulk_items(data)
+    except (KeyError, TypeError, ValueError, csv.Error): raise HTTPException(status_code=400, detail="Dữ liệu lô không hợp lệ!")
+    if not items: return {"status": "error", "message": "Lô không có lịch nào!"}
+    if len(items) > BULK_MAX_ITEMS: return {"status": "error", "message": f"Tối đa {BULK_MAX_ITEMS} lịch mỗi lô!"}
+
+    # 1. Chuẩn hóa thời gian, gom theo phòng
+    results = [None] * len(items)
+    by_room = {}
+    for index, item in enumerate(items):
+        try:
+            start, end = booking_interval(item['start_time'], item['duration_display'], strict=True)
+            by_room.setdefault(int(item['room_id']), []).append((start, end, index))
+        except Exception: results[index] = {"index": index, "status": "error", "message": "Lỗi định dạng dữ liệu!"}
+
+    # 2. Khóa mọi phòng trong lô, đọc lịch cũ của các phòng đó trong khoảng thời gian của lô bằng 1 truy vấn
+    await lock_rooms(db, by_room)
+    rooms = {r.id: r for r in await db.scalars(select(Classroom).where(Classroom.id.in_(by_room)))}
+    existing = {}
+    if by_room:
+        lo = min(start for requested in by_room.values() for start, _, _ in requested)
+        hi = max(end for requested in by_room.values() for _, end, _ in requested)
+        overlapping = union_tiers(booking_tiers(lo), lambda t: select(t.c.id, t.c.room_id, t.c.booker_name, t.c.start_at, t.c.end_at).where(
+            t.c.room_id.in_(by_room), *overlaps(t, lo, hi)))
+        rows = await db.execute(select(overlapping))
+        for b in rows: existing.setdefault(b.room_id, []).append((b.start_at, b.end_at, b))
+
+    # 3. Quét trùng từng phòng, mục hợp lệ được gom lại để insert 1 lần
+    booker_display = current_user.full_name if current_user.full_name else current_user.username
+    new_rows = []
+    for room_id, requested in by_room.items():
+        room = rooms.get(room_id)
+        if not room or room.status == 'Maintenance':
+            msg = "Phòng đang bảo trì!" if room else "Phòng không tồn tại!"
+            for _, _, index in requested: results[index] = {"index": index, "status": "error", "message": msg}
+            continue
+        conflicts = sweep_conflicts(existing.get(room_id, []), requested)
+        for start, end, index in requested:
+            other = conflicts.get(index)
+            if other is None:
+                new_rows.append({
+                    "room_id": room_id, "user_id": current_user.id, "booker_name": booker_display,
+                    "start_time": items[index]['start_time'], "duration_hours": items[index]['duration_display'],
+                    "start_at": start, "end_at": end, "status": "Pending",
+                })
+                results[index] = {"index": index, "status": "success"}
+            else:
+                msg = f"Bị trùng với mục #{other} trong lô!" if isinstance(other, int) else conflict_message(other)
+                results[index] = {"index": index, "status": "conflict", "message": msg}
+
+    # 4. atomic=true: có mục lỗi thì không lưu gì cả
+    failed = sum(1 for r in results if r["status"] != "success")
+    if failed and data.get('atomic'):
+        for r in results:
+            if r["status"] == "success": r["status"] = "skipped"
+        return {"status": "error", "message": f"Có {failed} mục lỗi, không lưu lịch nào!", "created": 0, "failed": failed, "results": results}
+    if new_rows: await db.execute(insert(Booking), new_rows)
+    await db.commit()
+    if new_rows:
+        await booking_events.publish(window_event([r["room_id"] for r in new_rows],
+                                                  [r["start_at"] for r in new_rows], [r["end_at"] for r in new_rows]))
+    return {"status": "success", "message": f"Đã đặt {len(new_rows)} lịch (Chờ duyệt)!",
+            "created": len(new_rows), "failed": failed, "results": results}
+
+async def publish_bulk_change(rows):
+    rows = [r for r in rows if r.start_at and r.end_at]
+    if rows: await booking_events.publish(window_event([r.room_id for r in rows], [r.start_at for r in rows], [r.end_at for r in rows]))
+
+@app.post("/api/bookings/bulk/approve")
+async def bulk_approve_bookings(data: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    ids = parse_booking_ids(data)
+    rows = (await db.execute(update(Booking).where(Booking.id.in_(ids)).values(status="Confirmed")
+                             .returning(Booking.room_id, Booking.start_at, Booking.end_at)
+                             .execution_options(synchronize_session=False))).all()
+    await db.commit()
+    await publish_bulk_change(rows)
+    return {"status": "success", "message": f"Đã duyệt {len(rows)} lịch!", "count": len(rows)}
+
+@app.post("/api/bookings/bulk/reject")
+async def bulk_reject_bookings(data: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    ids = parse_booking_ids(data)
+    rows = (await db.execute(delete(Booking).where(Booking.id.in_(ids))
+                             .returning(Booking.room_id, Booking.start_at, Booking.end_at)
+                             .execution_options(synchronize_session=False))).all()
+    await db.commit()
+    await publish_bulk_change(rows)
+    return {"status": "success", "message": f"Đã từ chối và hủy {len(rows)} lịch!", "count": len(rows)}
+
 # ============================================================
 # 8. API GROUP: QUẢN LÝ NGƯỜI DÙNG (ADMIN)
 # ============================================================
 
+@app.get("/api/users")
+async def list_users(db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin),
+                     q: str = "", role: str = None, cursor: int = None, limit: int = 50):
+    limit = max(1, min(limit, 200))
+    stmt = select(User.id, User.username, User.full_name, User.email, User.phone, User.role)
+    if role: stmt = stmt.where(User.role == role)
+    if cursor: stmt = stmt.where(User.id > cursor)  # Keyset: trang sau bắt đầu sau id cuối của trang trước
+    if q.strip(): stmt = stmt.where(user_search_filter(q.strip()))
+    rows = (await db.execute(stmt.order_by(User.id).limit(limit + 1))).all()
+    page = rows[:limit]
+    return {"status": "success", "users": [dict(r._mapping) for r in page],
+            "next_cursor": page[-1].id if len(rows) > limit else None}
+
 @app.post("/api/users/update")
-async def update_user(data: dict, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
-    u = db.query(User).filter(User.id == data['user_id']).first()
+async def update_user(data: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    u = await db.get(User, data['user_id'])
     if u:
         u.email = data.get('email'); u.phone = data.get('phone'); u.role = data.get('role')
         if data.get('new_password'): u.password = data['new_password']
-        db.commit()
+        await db.commit()
+        await booking_events.publish(user_changed_event(u.id))
         return {"status": "success"}
     return {"status": "error"}
 
 @app.post("/api/users/delete")
-async def delete_user(data: dict, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
-    u = db.query(User).filter(User.id == data['user_id']).first()
-    if u and u.id != current_user.id: db.delete(u); db.commit(); return {"status": "success"}
+async def delete_user(data: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    u = await db.get(User, data['user_id'])
+    if u and u.id != current_user.id:
+        user_id = u.id
+        await db.delete(u)
+        await db.execute(update(BookingArchive).where(BookingArchive.user_id == user_id).values(user_id=None))
+        await db.commit()
+        await booking_events.publish(user_changed_event(user_id))
+        return {"status": "success"}
     return {"status": "error"}
 
 # ============================================================
-# 9. FRONTEND ROUTES (VIEW HTML)
+# 9. API GROUP: XUẤT DỮ LIỆU & BÁO CÁO
+# ============================================================
+EXPORT_CSV_HEADER = ["id", "room_id", "room_name", "user_id", "booker_name", "start_at", "end_at", "duration_hours", "status"]
+
+@app.get("/api/export/bookings.csv")
+async def export_bookings_csv(request: Request, room_id: int = None, status: str = None, current_user: User = Depends(require_admin)):
+    try: window_from, window_to = export_window(request)
+    except ValueError: raise HTTPException(status_code=400, detail="Tham số from/to không hợp lệ!")
+
+    def build(t):
+        q = select(*(t.c[n] for n in BOOKING_COLUMNS)).where(*window_filter(t, window_from, window_to, room_id))
+        return q.where(t.c.status == status) if status else q
+
+    async def rows():
+        # Phiên riêng cho stream: phiên của dependency đã đóng trước khi body được gửi đi
+        async with AsyncSessionLocal() as db:
+            b = union_tiers(booking_tiers(window_from), build)
+            result = await db.stream(select(b, Classroom.room_name).outerjoin(Classroom, Classroom.id == b.c.room_id)
+                                     .order_by(b.c.start_at, b.c.id).execution_options(yield_per=EXPORT_BATCH_SIZE))
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            buf.write("\ufeff")  # BOM để Excel đọc đúng tiếng Việt
+            writer.writerow(EXPORT_CSV_HEADER)
+            async for partition in result.partitions():
+                for r in partition:
+                    # Tên người đặt/phòng do người dùng tự nhập -> chặn công thức khi admin mở bằng Excel
+                    writer.writerow([csv_safe(v) for v in (r.id, r.room_id, r.room_name, r.user_id, r.booker_name,
+                                     r.start_at.isoformat() + "Z" if r.start_at else "", r.end_at.isoformat() + "Z" if r.end_at else "",
+                                     r.duration_hours, r.status)])
+                yield buf.getvalue()
+                buf.seek(0); buf.truncate()
+            yield buf.getvalue()
+
+    return StreamingResponse(rows(), media_type="text/csv; charset=utf-8",
+                             headers={"Content-Disposition": 'attachment; filename="bookings.csv"'})
+
+@app.get("/api/export/rooms/{room_id}.ics")
+async def export_room_ics(room_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    if not await get_current_user(request, db): raise HTTPException(status_code=401, detail="Chưa đăng nhập!")
+    room = await db.get(Classroom, room_id)
+    if not room: raise HTTPException(status_code=404, detail="Phòng không tồn tại!")
+    try: window_from, window_to = export_window(request)
+    except ValueError: raise HTTPException(status_code=400, detail="Tham số from/to không hợp lệ!")
+    room_name, stamp = room.room_name, ics_time(utc_now())
+
+    async def calendar():
+        yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//EduManager//Lich phong hoc//VI\r\nCALSCALE:GREGORIAN\r\n"
+        yield ics_line("X-WR-CALNAME", ics_text(room_name))
+        async with AsyncSessionLocal() as db:
+            b = union_tiers(booking_tiers(window_from), lambda t: select(*(t.c[n] for n in BOOKING_COLUMNS)).where(
+                *window_filter(t, window_from, window_to, room_id), t.c.start_at.is_not(None)))
+            result = await db.stream(select(b).order_by(b.c.start_at, b.c.id).execution_options(yield_per=EXPORT_BATCH_SIZE))
+            async for partition in result.partitions():
+                yield "".join(ics_event(r, room_name, stamp) for r in partition)
+        yield "END:VCALENDAR\r\n"
+
+    return StreamingResponse(calendar(), media_type="text/calendar; charset=utf-8",
+                             headers={"Content-Disposition": f'attachment; filename="room-{room_id}.ics"'})
+
+@app.get("/api/reports/utilization")
+async def utilization_report(request: Request, granularity: str = "day", room_id: int = None,
+                             db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    try:
+        window_from = parse_start_time(request.query_params['from'])
+        window_to = parse_start_time(request.query_params['to'])
+    except (KeyError, ValueError): raise HTTPException(status_code=400, detail="Tham số from/to không hợp lệ!")
+    if window_to <= window_from: raise HTTPException(status_code=400, detail="to phải sau from!")
+    if granularity not in ("day", "week"): raise HTTPException(status_code=400, detail="granularity là day hoặc week!")
+    if window_to - window_from > timedelta(days=731): raise HTTPException(status_code=400, detail="Tối đa 2 năm mỗi báo cáo!")
+    return await utilization_reports.get(db, window_from, window_to, granularity, room_id)
+
+# ============================================================
+# 10. FRONTEND ROUTES (VIEW HTML)
 # ============================================================
 
 @app.get("/", response_class=HTMLResponse)
-async def root(request: Request): return templates.TemplateResponse("login.html", {"request": request})
+async def root(request: Request): return render_page("login.html", {"request": request})
 
 @app.get("/register", response_class=HTMLResponse)
-async def reg(request: Request): return templates.TemplateResponse("register.html", {"request": request})
+async def reg(request: Request): return render_page("register.html", {"request": request})
 
 @app.get("/forgot-password", response_class=HTMLResponse)
-async def forgot(request: Request): return templates.TemplateResponse("forgotpw.html", {"request": request})
+async def forgot(request: Request): return render_page("forgotpw.html", {"request": request})
 
 @app.get("/verify", response_class=HTMLResponse)
-async def verify_page(request: Request): return templates.TemplateResponse("verify.html", {"request": request})
+async def verify_page(request: Request): return render_page("verify.html", {"request": request})
 
 @app.get("/logout")
 async def logout(response: Response): 
     response = RedirectResponse("/")
-    response.delete_cookie("current_user")
+    response.delete_cookie(SESSION_COOKIE)
     return response
 
 @app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(request: Request, db: Session = Depends(get_db)):
-    u = get_current_user(request, db)
+async def dashboard(request: Request, db: AsyncSession = Depends(get_db)):
+    u = await get_current_user(request, db)
     if not u: return RedirectResponse("/")
-    rooms = db.query(Classroom).all()
-    booking_count = db.query(Booking).count() if u.role == 'admin' else db.query(Booking).filter(Booking.user_id == u.id).count()
-    
-    bookings_db = db.query(Booking).order_by(Booking.id.desc()).limit(10).all()
-    history = []
-    for b in bookings_db:
-        r = db.query(Classroom).filter(Classroom.id == b.room_id).first()
-        history.append({
-            "booker": b.booker_name, "room_name": r.room_name if r else "Unknown", 
-            "time": b.start_time, "duration": b.duration_hours, "status": b.status
-        })
-
-    return templates.TemplateResponse("index.html", {
+    # Số liệu lấy từ bộ đếm trong bộ nhớ; DB chỉ bị hỏi khi bộ đếm hết hạn hoặc bị đánh dấu cần nạp lại
+    await dashboard_stats.ensure_fresh(db)
+    return render_page("index.html", {
         "request": request, "username": u.username, "full_name": u.full_name, "role": u.role,
-        "classrooms": rooms, "total_rooms": len(rooms), 
-        "active_rooms": len([r for r in rooms if r.status=='Available']),
-        "booking_count": booking_count, "history": history
+        **dashboard_stats.view(u)
     })
 
 @app.get("/room-management", response_class=HTMLResponse)
-async def room_mgmt(request: Request, db: Session = Depends(get_db)):
-    u = get_current_user(request, db)
+async def room_mgmt(request: Request, db: AsyncSession = Depends(get_db)):
+    u = await get_current_user(request, db)
     if not u: return RedirectResponse("/")
-    return templates.TemplateResponse("room_management.html", {
-        "request": request, "classrooms": db.query(Classroom).all(), 
+    return render_page("room_management.html", {
+        "request": request, "classrooms": (await db.scalars(select(Classroom))).all(), 
         "role": u.role, "username": u.username, "full_name": u.full_name
     })
 
 @app.get("/booking-scheduler", response_class=HTMLResponse)
-async def scheduler(request: Request, db: Session = Depends(get_db)):
-    u = get_current_user(request, db)
+async def scheduler(request: Request, db: AsyncSession = Depends(get_db)):
+    u = await get_current_user(request, db)
     if not u: return RedirectResponse("/")
     
-    bookings = [{
-        "id":b.id, "room_id":b.room_id, "booker_name":b.booker_name, 
-        "start_time":b.start_time, "duration_hours":b.duration_hours, "status": b.status
-    } for b in db.query(Booking).all()]
-    
-    rooms = [{
-        "id":c.id, "room_name":c.room_name, "capacity":c.capacity, 
-        "equipment":c.equipment, "status":c.status
-    } for c in db.query(Classroom).all()]
+    rooms = [room_to_dict(c) for c in await db.scalars(select(Classroom))]
     
-    return templates.TemplateResponse("booking_scheduler.html", {
-        "request": request, "classrooms": rooms, "bookings": bookings, 
+    return render_page("booking_scheduler.html", {
+        "request": request, "classrooms": rooms, 
         "username": u.username, "role": u.role, "full_name": u.full_name
     })
 
 @app.get("/user-management", response_class=HTMLResponse)
-async def user_mgmt(request: Request, db: Session = Depends(get_db)):
-    u = get_current_user(request, db)
+async def user_mgmt(request: Request, db: AsyncSession = Depends(get_db)):
+    u = await get_current_user(request, db)
     if not u or u.role != "admin": return RedirectResponse("/dashboard")
-    return templates.TemplateResponse("user_management.html", {
-        "request": request, "users": db.query(User).all(), 
-        "username": u.username, "role": u.role, "full_name": u.full_name
+    # Danh sách người dùng được trang tự tải dần qua /api/users
+    return render_page("user_management.html", {
+        "request": request, "username": u.username, "role": u.role, "full_name": u.full_name
     })
 
 @app.get("/profile", response_class=HTMLResponse)
-async def profile(request: Request, db: Session = Depends(get_db)):
-    u = get_current_user(request, db)
+async def profile(request: Request, db: AsyncSession = Depends(get_db)):
+    u = await get_current_user(request, db)
     if not u: return RedirectResponse("/")
-    user_bookings = db.query(Booking).filter(Booking.user_id == u.id).all()
-    history = []
-    for b in user_bookings:
-        r = db.query(Classroom).filter(Classroom.id==b.room_id).first()
-        history.append({
-            "room_name": r.room_name if r else "Unknown", 
-            "start_time": b.start_time, "duration": b.duration_hours, "status": b.status
-        })
-    return templates.TemplateResponse("profile.html", {
+    # Lịch sử đọc cả 2 tầng: lịch sắp tới/gần đây ở bookings, lịch đã kết thúc ở bookings_archive
+    b = union_tiers(booking_tiers(None), lambda t: select(t.c.id, t.c.room_id, t.c.start_time, t.c.duration_hours, t.c.status)
+                    .where(t.c.user_id == u.id))
+    user_bookings = await db.execute(select(b, Classroom.room_name).outerjoin(Classroom, Classroom.id == b.c.room_id).order_by(b.c.id))
+    history = [{
+        "room_name": row.room_name or "Unknown", 
+        "start_time": row.start_time, "duration": row.duration_hours, "status": row.status
+    } for row in user_bookings]
+    return render_page("profile.html", {
         "request": request, "user": u, "username": u.username, 
         "role": u.role, "full_name": u.full_name, "history": history
     })
 
 # ============================================================
-# 10. STARTUP EVENT (DỮ LIỆU MẪU)
+# 11. GIÁM SÁT (PROMETHEUS, HEALTH CHECK)
+# ============================================================
+metrics.gauges["mail_queue_depth"] = mail_dispatcher.queue.qsize
+metrics.gauges["booking_event_subscribers"] = lambda: len(booking_events.subscribers)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# --- Vòng đời tiến trình: load balancer hỏi /healthz (còn sống) và /readyz (nhận tải được không) ---
+class Lifecycle:
+    def __init__(self):
+        self.ready = False
+        self.draining = False
+
+    def install_drain_handlers(self):
+        """Nối vào handler SIGTERM/SIGINT sẵn có của uvicorn/gunicorn: báo không sẵn sàng trước khi server dừng nhận request."""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(sig)
+
+            def handler(signum, frame, previous=previous):
+                loop.call_soon_threadsafe(self.begin_drain)
+                if callable(previous): previous(signum, frame)
+                elif previous == signal.SIG_DFL:
+                    signal.signal(signum, signal.SIG_DFL)
+                    os.kill(os.getpid(), signum)
+
+            try: signal.signal(sig, handler)
+            except ValueError: return  # Không chạy ở main thread (test client...)
+
+    def begin_drain(self):
+        if self.draining: return
+        self.draining, self.ready = True, False
+        # Stream SSE không tự kết thúc: đóng ngay để server không phải chờ hết GRACEFUL_TIMEOUT, client tự nối sang worker khác
+        for sub in list(booking_events.subscribers): sub.push(None)
+
+lifecycle = Lifecycle()
+
+@app.get("/healthz")
+async def liveness():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readiness():
+    if not lifecycle.ready:
+        reason = "draining" if lifecycle.draining else "starting"
+        return Response(json_dumps({"status": "unavailable", "reason": reason}), status_code=503, media_type="application/json")
+    try:
+        async with AsyncSessionLocal() as db: await asyncio.wait_for(db.execute(text("SELECT 1")), timeout=2)
+    except Exception:
+        return Response(json_dumps({"status": "unavailable", "reason": "database"}), status_code=503, media_type="application/json")
+    return {"status": "ready"}
+
+# ============================================================
+# 12. STARTUP EVENT (DỮ LIỆU MẪU)
 # ============================================================
 @app.on_event("startup")
-def startup_event():
+async def start_mail_dispatcher():
+    await mail_dispatcher.start()
+
+@app.on_event("shutdown")
+async def stop_mail_dispatcher():
+    await mail_dispatcher.stop()
+
+@app.on_event("startup")
+async def start_booking_events():
+    await booking_events.start()
+
+@app.on_event("shutdown")
+async def stop_booking_events():
+    await booking_events.stop()
+
+@app.on_event("startup")
+async def start_booking_archiver():
+    await booking_archiver.start()
+
+@app.on_event("shutdown")
+async def stop_booking_archiver():
+    await booking_archiver.stop()
+
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    await async_engine.dispose()
+
+@contextmanager
+def init_lock():
+    """Khóa giữa các tiến trình cho bước khởi tạo CSDL: advisory lock (PostgreSQL, cả nhiều máy) hoặc khóa file (SQLite)."""
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": INIT_LOCK_KEY})
+            try: yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INIT_LOCK_KEY})
+                conn.commit()
+        return
+    with open(INIT_LOCK_FILE, "a+b") as f:
+        f.seek(0)
+        if fcntl: fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            while True:
+                try: msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1); break
+                except OSError: pass  # LK_LOCK chỉ thử lại ~10 giây rồi báo lỗi
+        try: yield
+        finally:
+            if fcntl: fcntl.flock(f, fcntl.LOCK_UN)
+            else: f.seek(0); msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def init_database():
+    """Tạo bảng, chạy migration, seed dữ liệu mẫu. Mọi bước đều bỏ qua phần đã có nên tiến trình vào sau không làm gì thêm."""
+    with init_lock():
+        Base.metadata.create_all(bind=engine)
+        migrate_booking_intervals()
+        migrate_booking_ids()
+        migrate_user_search()
+        seed_sample_data()
+
+def seed_sample_data():
     db = SessionLocal()
     # Tạo Admin
     if not db.query(User).filter(User.username == "admin").first():
@@ -515,5 +2366,61 @@ def startup_event():
     db.commit()
     db.close()
 
+@app.on_event("startup")
+def startup_event():
+    # python app.py serve đã khởi tạo ở tiến trình cha, worker chỉ đọc lại trạng thái
+    if os.getenv("SKIP_DB_INIT") == "1": detect_user_search()
+    else: init_database()
+    if not os.getenv("SESSION_SECRET"):
+        # uvicorn --workers N: mỗi worker tự sinh khóa riêng -> phiên ký ở worker này bị worker khác từ chối
+        print("Cảnh báo: chưa đặt SESSION_SECRET, phiên đăng nhập ký bằng khóa tạm của riêng tiến trình này. Chạy nhiều worker thì phải đặt SESSION_SECRET.")
+
+@app.on_event("startup")
+async def mark_ready():
+    lifecycle.install_drain_handlers()
+    warm_templates()
+    lifecycle.ready = True
+
+# --- Chạy production: python app.py serve --workers 4 --host 0.0.0.0 ---
+def serve(args):
+    init_database()  # Đúng 1 lần ở tiến trình cha, trước khi có worker nào
+    engine.dispose()  # Worker (fork) không dùng lại kết nối của tiến trình cha
+    os.environ["SKIP_DB_INIT"] = "1"
+    if not os.getenv("SESSION_SECRET"):
+        print("Cảnh báo: chưa đặt SESSION_SECRET, dùng khóa tạm cho lần chạy này (khởi động lại sẽ đăng xuất mọi người).")
+        os.environ["SESSION_SECRET"] = SESSION_SECRET  # Mọi worker phải ký phiên bằng cùng 1 khóa
+    if args.workers > 1 and not BOOKING_EVENTS_URL:
+        print("Cảnh báo: nhiều worker nhưng chưa đặt BOOKING_EVENTS_URL, trang lịch chỉ nhận sự kiện của worker mình kết nối, "
+              f"cache user ở worker khác có thể cũ tới {USER_CACHE_TTL:g} giây.")
+    if args.workers > 1 and not AUTH_STORE_URL:
+        print("Cảnh báo: nhiều worker nhưng chưa đặt AUTH_STORE_URL, giới hạn đăng nhập/gửi OTP tính riêng từng worker (mã OTP vẫn dùng chung qua DB).")
+    try: from gunicorn.app.base import BaseApplication
+    except ImportError: BaseApplication = None
+    if BaseApplication is None:
+        # Windows / chưa cài gunicorn: uvicorn tự quản lý worker (mỗi worker import lại app)
+        uvicorn.run("app:app", host=args.host, port=args.port, workers=args.workers, proxy_headers=True,
+                    timeout_graceful_shutdown=GRACEFUL_TIMEOUT)
+        return
+
+    class Launcher(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{args.host}:{args.port}")
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("worker_class", "uvicorn.workers.UvicornWorker")
+            self.cfg.set("preload_app", True)  # Import app 1 lần ở tiến trình cha rồi fork
+            self.cfg.set("graceful_timeout", GRACEFUL_TIMEOUT)
+
+        def load(self): return app
+
+    Launcher().run()
+
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="EduManager")
+    sub = parser.add_subparsers(dest="command")
+    prod = sub.add_parser("serve", help="Chạy production nhiều worker")
+    prod.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    prod.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    prod.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    args = parser.parse_args()
+    if args.command == "serve": serve(args)
+    else: uvicorn.run("app:app", host="127.0.0.1", port=8000, reload=True)  # Chạy dev
\ No newline at end of file
@@ -0,0 +1,12 @@
+"""Bộ đo hiệu năng EduManager. Chạy từ thư mục gốc repo dưới dạng module: python -m benchmarks.<tên>
+
+    seed_data       Sinh dữ liệu giả (users, classrooms, bookings) ở quy mô tùy chọn, tới hàng triệu lịch đặt
+    micro           Đo trong tiến trình: check trùng lịch của create_booking, render /dashboard, /profile, /booking-scheduler
+    scenario        Tải HTTP qua server thật: đăng nhập -> dashboard -> đặt phòng -> duyệt
+    delivery        Byte truyền đi và TTFB từng trang: không nén / gzip / br / tải lại có ETag
+    concurrency     Ghi đồng thời /api/bookings/create
+    page_load       Tải hỗn hợp các trang/API đọc
+    double_booking  Stress test trùng lịch
+
+micro, scenario và delivery ghi báo cáo JSON (--output) và so với báo cáo cũ (--baseline): chậm hơn quá ngưỡng thì thoát mã 1.
+"""
@@ -0,0 +1,92 @@
+"""Đo đường trả trang: số byte truyền đi và TTFB của từng trang theo kiểu tải (không nén / gzip / br / tải lại có ETag).
+
+    RATE_LIMIT=0 SESSION_SECRET=bench DATABASE_URL=sqlite:///./bench.db uvicorn app:app --port 8000
+    python -m benchmarks.delivery --base-url http://127.0.0.1:8000 --output delivery.json
+    python -m benchmarks.delivery --base-url http://127.0.0.1:8000 --baseline delivery.json   # thoát mã 1 nếu chậm đi
+
+"identity" là cách trả trang trước khi tối ưu (không nén, tải lại nhận trọn HTML); "gzip"/"br" là lần tải đầu có nén;
+"revalidate" là lần tải lại gửi If-None-Match (server trả 304 nếu trang không đổi), file tĩnh thì dùng URL có hash.
+TTFB tính từ lúc gửi request tới khi nhận header, nên phải đo qua server thật: httpx.ASGITransport gom cả body mới trả về.
+Số byte là body trên dây (chưa giải nén), không tính header.
+"""
+import argparse
+import asyncio
+import re
+import sys
+import time
+
+import httpx
+
+from benchmarks import report as bench_report
+
+PAGES = [("login", "/"), ("dashboard", "/dashboard"), ("booking_scheduler", "/booking-scheduler"),
+         ("room_management", "/room-management"), ("profile", "/profile"), ("api_bookings_day", None)]
+MODES = {"identity": "identity", "gzip": "gzip", "br": "br, gzip"}
+
+
+async def fetch(client, path, headers):
+    """Trả về (response, TTFB, tổng thời gian, số byte body trên dây)."""
+    t0 = time.perf_counter()
+    async with client.stream("GET", path, headers=headers) as r:
+        ttfb = time.perf_counter() - t0
+        wire = 0
+        async for chunk in r.aiter_raw(): wire += len(chunk)
+    return r, ttfb, time.perf_counter() - t0, wire
+
+
+async def measure(client, path, headers, iterations, warmup):
+    for _ in range(warmup): await fetch(client, path, headers)
+    ttfbs, totals = [], []
+    for _ in range(iterations):
+        r, ttfb, total, wire = await fetch(client, path, headers)
+        if r.status_code not in (200, 304): raise SystemExit(f"{path} trả về {r.status_code}")
+        ttfbs.append(ttfb)
+        totals.append(total)
+    return {**bench_report.summarize(ttfbs), "total_p95_ms": round(bench_report.percentile([x * 1000 for x in totals], 95), 3),
+            "bytes": wire, "status": r.status_code, "content_encoding": r.headers.get("content-encoding", "identity")}
+
+
+async def run(args):
+    report = bench_report.new_report("delivery", base_url=args.base_url, iterations=args.iterations, username=args.username)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+        r = await client.post("/api/login", json={"username": args.username, "password": args.password})
+        if r.json().get("status") != "success": raise SystemExit(f"Không đăng nhập được bằng {args.username}")
+        found = re.search(r'href="(/static/[^"]+)"', (await client.get("/dashboard")).text)
+        # /api/bookings của 1 ngày như trang lịch tự tải: JSON cũng được nén và trả 304 khi lịch không đổi
+        day = f"/api/bookings?from={args.date}T00:00:00.000Z&to={args.date}T23:59:59.000Z"
+        pages = [(name, path or day) for name, path in PAGES] + [("static_style", found.group(1) if found else "/static/style.css")]
+
+        savings = {}
+        for name, path in pages:
+            for mode, accept in MODES.items():
+                report["results"][f"{name}:{mode}"] = await measure(client, path, {"accept-encoding": accept}, args.iterations, args.warmup)
+            # Tải lại: trang dùng ETag của lần tải trước, file tĩnh có hash thì trình duyệt không hỏi lại (đo lần hỏi lại URL trần)
+            first, *_ = await fetch(client, path, {"accept-encoding": "gzip"})
+            etag = first.headers.get("etag")
+            if etag:
+                report["results"][f"{name}:revalidate"] = await measure(
+                    client, path, {"accept-encoding": "gzip", "if-none-match": etag}, args.iterations, args.warmup)
+            before = report["results"][f"{name}:identity"]["bytes"]
+            best = min(report["results"][f"{name}:{mode}"]["bytes"] for mode in MODES)
+            savings[name] = {"identity_bytes": before, "compressed_bytes": best,
+                             "saved_percent": round(100 * (1 - best / before), 1) if before else 0.0,
+                             "cache_control": first.headers.get("cache-control")}
+        report["summary"] = savings
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="123")
+    parser.add_argument("--date", default="2030-01-01", help="Ngày có dữ liệu của seed_data, cho /api/bookings")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    bench_report.add_arguments(parser)
+    args = parser.parse_args()
+    sys.exit(bench_report.finish(asyncio.run(run(args)), args))
+
+
+if __name__ == "__main__":
+    main()
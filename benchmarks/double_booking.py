@@ -0,0 +1,99 @@
+"""Stress test trùng lịch: rất nhiều client cùng đặt những khung giờ chồng nhau, sau đó kiểm tra không có lịch trùng.
+
+    RATE_LIMIT=0 SESSION_SECRET=stress DATABASE_URL=sqlite:///./stress.db uvicorn app:app --port 8000 --workers 4
+    python -m benchmarks.double_booking --base-url http://127.0.0.1:8000 --clients 64 --rounds 50
+
+Mỗi vòng, tất cả client bắn cùng lúc vào 1 khung 1 giờ của mỗi phòng, một nửa lệch 30 phút để tạo chồng lấn một phần.
+Với mỗi vòng chỉ được đúng 1 lịch thành công trên mỗi phòng. Script thoát với mã 1 nếu tìm thấy lịch trùng. RATE_LIMIT=0 tắt giới hạn đăng nhập theo IP (mọi client cùng 1 máy).
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Barrier, local
+
+from benchmarks.concurrency import login
+
+_thread = local()
+
+
+def find_overlaps(bookings):
+    """Trả về các cặp (id, id) trùng giờ trên cùng phòng."""
+    overlaps = []
+    by_room = {}
+    for b in bookings: by_room.setdefault(b["room_id"], []).append(b)
+    for rows in by_room.values():
+        rows.sort(key=lambda b: b["start_at"])
+        for prev, cur in zip(rows, rows[1:]):
+            if cur["start_at"] < prev["end_at"]: overlaps.append((prev["id"], cur["id"]))
+    return overlaps
+
+
+def fetch_window(session, base_url, window_from, window_to):
+    bookings, cursor = [], None
+    while True:
+        params = {"from": window_from, "to": window_to, "limit": 1000}
+        if cursor: params["cursor"] = cursor
+        page = session.get(f"{base_url}/api/bookings", params=params, timeout=60).json()
+        bookings.extend(page["bookings"])
+        cursor = page["next_cursor"]
+        if not cursor: return bookings
+
+
+def run(args):
+    room_ids = [int(x) for x in args.room_ids.split(",")]
+    base = datetime.fromisoformat(args.start_date)
+    barrier = Barrier(args.clients)
+
+    def client():
+        if not hasattr(_thread, "session"): _thread.session = login(args.base_url, args.username, args.password)
+        return _thread.session
+
+    def worker(n):
+        session = client()
+        accepted = 0
+        for round_no in range(args.rounds):
+            slot = base + timedelta(hours=2 * round_no, minutes=30 * (n % 2))
+            barrier.wait()  # Mọi client bắt đầu vòng cùng lúc
+            for room_id in room_ids:
+                payload = {"room_id": room_id, "start_time": slot.isoformat() + ".000Z", "duration_display": "1 Giờ"}
+                r = session.post(f"{args.base_url}/api/bookings/create", json=payload, timeout=60)
+                if r.status_code == 200 and r.json().get("status") == "success": accepted += 1
+        return accepted
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        accepted = sum(pool.map(worker, range(args.clients)))
+    wall = time.perf_counter() - t0
+
+    window_to = base + timedelta(hours=2 * args.rounds + 1)
+    bookings = [b for b in fetch_window(client(), args.base_url, base.isoformat() + "Z", window_to.isoformat() + "Z")
+                if b["room_id"] in room_ids]
+    overlaps = find_overlaps(bookings)
+    return {
+        "clients": args.clients, "rounds": args.rounds, "rooms": len(room_ids),
+        "attempts": args.clients * args.rounds * len(room_ids), "accepted": accepted,
+        "stored": len(bookings), "expected_max": args.rounds * len(room_ids),
+        "double_bookings": len(overlaps), "overlapping_ids": overlaps[:20],
+        "wall_seconds": round(wall, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="123")
+    parser.add_argument("--room-ids", default="1,2,3")
+    parser.add_argument("--start-date", default="2036-01-01T00:00:00")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=20)
+    report = run(parser.parse_args())
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["double_bookings"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Micro-benchmark trong tiến trình: check trùng lịch của create_booking và render các trang nặng.
+
+    python -m benchmarks.seed_data --database-url sqlite:///./bench.db --bookings 1000000
+    python -m benchmarks.micro --database-url sqlite:///./bench.db --output micro.json
+    python -m benchmarks.micro --database-url sqlite:///./bench.db --baseline micro.json   # thoát mã 1 nếu chậm đi
+
+Trang được gọi qua httpx.ASGITransport (không qua mạng, không cần uvicorn) nên số đo là thời gian của app:
+middleware, truy vấn DB, render Jinja. Check trùng lịch đo đúng vùng khóa của create_booking (lock_rooms + truy vấn
+khoảng thời gian) rồi rollback, để DB không đổi giữa các lần chạy.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import report as bench_report
+
+PAGES = [("render_dashboard", "/dashboard"), ("render_profile", "/profile"), ("render_booking_scheduler", "/booking-scheduler")]
+
+
+async def measure(fn, iterations, warmup):
+    for _ in range(warmup): await fn()
+    latencies = []
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        latencies.append(time.perf_counter() - start)
+    return bench_report.summarize(latencies, time.perf_counter() - t0)
+
+
+async def bench_conflict_check(app, rng, args):
+    from sqlalchemy import func, select
+
+    async with app.AsyncSessionLocal() as db:
+        room_ids = list(await db.scalars(select(app.Classroom.id)))
+        lo, hi = (await db.execute(select(func.min(app.Booking.start_at), func.max(app.Booking.end_at)))).one()
+    lo = lo or datetime.fromisoformat(args.start_date)
+    span = max(int(((hi or lo) - lo).total_seconds() // 1800), 1)  # Số khung 30 phút trong vùng có dữ liệu
+    hits = 0
+
+    async def one():
+        nonlocal hits
+        room_id = rng.choice(room_ids)
+        start = lo + timedelta(minutes=30 * rng.randrange(span))
+        async with app.AsyncSessionLocal() as db:
+            await app.lock_rooms(db, [room_id])
+            b = await db.scalar(select(app.Booking).where(
+                app.Booking.room_id == room_id, app.Booking.start_at < start + timedelta(hours=1), app.Booking.end_at > start
+            ).limit(1))
+            if b: hits += 1
+            await db.rollback()
+
+    result = await measure(one, args.iterations, args.warmup)
+    result["conflict_ratio"] = round(hits / (args.iterations + args.warmup), 3)
+    return result
+
+
+def bench_sweep_conflicts(app, rng, args):
+    """Check trùng của /api/bookings/bulk: 1 lần quét sắp xếp trên lịch cũ + lô mới của 1 phòng."""
+    base = datetime.fromisoformat(args.start_date)
+    existing = [(base + timedelta(hours=2 * i), base + timedelta(hours=2 * i + 1), i) for i in range(args.bulk_size)]
+    requested = []
+    for i in range(args.bulk_size):
+        start = base + timedelta(minutes=30 * rng.randrange(args.bulk_size * 4))
+        requested.append((start, start + timedelta(hours=1), i))
+    latencies = []
+    for _ in range(max(args.iterations // 20, 5)):
+        t0 = time.perf_counter()
+        app.sweep_conflicts(existing, requested)
+        latencies.append(time.perf_counter() - t0)
+    return bench_report.summarize(latencies)
+
+
+async def bench_pages(app, args):
+    import httpx
+
+    results = {}
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        r = await client.post("/api/login", json={"username": args.username, "password": args.password})
+        if r.json().get("status") != "success": raise SystemExit(f"Không đăng nhập được bằng {args.username}")
+        for name, path in PAGES:
+            async def one(path=path):
+                r = await client.get(path)
+                if r.status_code != 200: raise SystemExit(f"{path} trả về {r.status_code}")
+            results[name] = await measure(one, args.iterations, args.warmup)
+
+        # Trang lịch tự tải dữ liệu ngày qua /api/bookings -> đo luôn lần tải đó
+        day = datetime.fromisoformat(args.start_date)
+        window = {"from": day.isoformat() + "Z", "to": (day + timedelta(days=1)).isoformat() + "Z"}
+        results["api_bookings_day"] = await measure(lambda: client.get("/api/bookings", params=window), args.iterations, args.warmup)
+    return results
+
+
+async def run(args):
+    os.environ["DATABASE_URL"] = args.database_url  # app đọc cấu hình lúc import
+    import app
+
+    rng = random.Random(args.seed)
+    app.startup_event()
+    report = bench_report.new_report("micro", database_url=args.database_url, iterations=args.iterations,
+                                     username=args.username, bulk_size=args.bulk_size)
+    report["results"]["conflict_check"] = await bench_conflict_check(app, rng, args)
+    report["results"]["bulk_sweep_conflicts"] = bench_sweep_conflicts(app, rng, args)
+    report["results"].update(await bench_pages(app, args))
+    await app.async_engine.dispose()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///./bench.db"))
+    parser.add_argument("--username", default="admin", help="Tài khoản dùng để render trang (profile của người này)")
+    parser.add_argument("--password", default="123")
+    parser.add_argument("--start-date", default="2030-01-01T00:00:00", help="Ngày có dữ liệu của seed_data")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--bulk-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    bench_report.add_arguments(parser)
+    args = parser.parse_args()
+    sys.exit(bench_report.finish(asyncio.run(run(args)), args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Tải hỗn hợp các trang/API đọc (dashboard, scheduler, /api/bookings...) từ nhiều client đồng thời.
+
+Dùng để so sánh handler đồng bộ cũ với đường truy cập DB async. Chạy cùng lệnh với 2 bản code:
+
+    git worktree add ../edu-sync <commit trước khi chuyển sang async>
+    (cd ../edu-sync && DATABASE_URL=sqlite:///./bench.db uvicorn app:app --port 8001)
+    python -m benchmarks.page_load --base-url http://127.0.0.1:8001 --label sync
+
+    RATE_LIMIT=0 DATABASE_URL=sqlite:///./bench.db uvicorn app:app --port 8000   # tắt giới hạn đăng nhập theo IP
+    python -m benchmarks.page_load --base-url http://127.0.0.1:8000 --label async
+
+Với handler đồng bộ, mọi truy vấn chạy trên thread của event loop nên các request xếp hàng nối tiếp:
+thông lượng gần như không tăng theo --clients. Với bản async, I/O của các request chạy chồng lên nhau.
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import local
+
+import requests
+
+from benchmarks.concurrency import login, percentile
+
+_thread = local()
+
+
+def routes(args):
+    start = datetime.fromisoformat(args.start_date)
+    window = {"from": start.isoformat() + "Z", "to": (start + timedelta(days=7)).isoformat() + "Z"}
+    return [
+        ("dashboard", "/dashboard", None),
+        ("booking-scheduler", "/booking-scheduler", None),
+        ("profile", "/profile", None),
+        ("room-management", "/room-management", None),
+        ("api-bookings", "/api/bookings", window),
+    ]
+
+
+def run(args):
+    plan = routes(args)
+
+    def client():
+        if not hasattr(_thread, "session"): _thread.session = login(args.base_url, args.username, args.password)
+        return _thread.session
+
+    def one(i):
+        name, path, params = plan[i % len(plan)]
+        t0 = time.perf_counter()
+        try:
+            r = client().get(f"{args.base_url}{path}", params=params, timeout=60, allow_redirects=False)
+            return name, time.perf_counter() - t0, r.status_code == 200
+        except requests.RequestException:
+            return name, time.perf_counter() - t0, False
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - t0
+
+    per_route = {}
+    for name, _, _ in plan:
+        latencies = [r[1] * 1000 for r in results if r[0] == name]
+        per_route[name] = {p: round(percentile(latencies, int(p[1:])), 2) for p in ("p50", "p95", "p99")}
+    return {
+        "label": args.label, "clients": args.clients, "requests": args.requests,
+        "wall_seconds": round(wall, 3), "throughput_rps": round(args.requests / wall, 1),
+        "errors": sum(1 for r in results if not r[2]), "latency_ms": per_route,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="123")
+    parser.add_argument("--start-date", default="2035-01-01T00:00:00")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--label", default="async")
+    print(json.dumps(run(parser.parse_args()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
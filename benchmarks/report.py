@@ -0,0 +1,70 @@
+"""Báo cáo JSON dùng chung cho micro và scenario: tóm tắt latency, ghi file, so với báo cáo cũ."""
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarize(latencies, wall=None):
+    """latencies tính bằng giây -> số liệu ms; có wall thì thêm thông lượng."""
+    ms = [x * 1000 for x in latencies]
+    summary = {
+        "count": len(ms), "mean_ms": round(sum(ms) / len(ms), 3) if ms else 0.0,
+        **{p: round(percentile(ms, int(p[1:])), 3) for p in ("p50", "p95", "p99")},
+        "max_ms": round(max(ms), 3) if ms else 0.0,
+    }
+    if wall: summary["throughput_per_sec"] = round(len(ms) / wall, 1)
+    return summary
+
+
+def git_commit():
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError: return None
+
+
+def new_report(kind, **params):
+    return {
+        "kind": kind, "created_at": datetime.now(timezone.utc).isoformat(), "commit": git_commit(),
+        "python": platform.python_version(), "params": params, "results": {},
+    }
+
+
+def write(report, path):
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if path:
+        with open(path, "w", encoding="utf-8") as f: f.write(text + "\n")
+    print(text)
+
+
+def compare(report, baseline_path, tolerance):
+    """So p95 và thông lượng từng mục với báo cáo cũ, trả về danh sách mục chậm đi quá tolerance (0.2 = 20%)."""
+    with open(baseline_path, encoding="utf-8") as f: baseline = json.load(f)
+    regressions = []
+    for name, cur in report["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old: continue
+        if old.get("p95", 0) > 0 and cur["p95"] > old["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old['p95']}ms -> {cur['p95']}ms")
+        if old.get("throughput_per_sec", 0) > 0 and cur.get("throughput_per_sec", 0) < old["throughput_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: thông lượng {old['throughput_per_sec']}/s -> {cur['throughput_per_sec']}/s")
+    return regressions
+
+
+def add_arguments(parser):
+    parser.add_argument("--output", help="Ghi báo cáo JSON ra file")
+    parser.add_argument("--baseline", help="Báo cáo JSON cũ để so sánh")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Ngưỡng chậm đi cho phép so với baseline (0.2 = 20%%)")
+
+
+def finish(report, args):
+    """Ghi báo cáo, so baseline; trả về mã thoát cho sys.exit."""
+    if args.baseline:
+        report["regressions"] = compare(report, args.baseline, args.max_regression)
+    write(report, args.output)
+    return 1 if report.get("regressions") else 0
@@ -0,0 +1,133 @@
+"""Kịch bản tải HTTP: đăng nhập -> dashboard -> đặt phòng -> admin duyệt, nhiều người dùng ảo chạy song song (asyncio + httpx).
+
+    python -m benchmarks.seed_data --database-url sqlite:///./bench.db --users 500
+    RATE_LIMIT=0 SESSION_SECRET=bench DATABASE_URL=sqlite:///./bench.db uvicorn app:app --port 8000   # tắt giới hạn đăng nhập/OTP
+    python -m benchmarks.scenario --base-url http://127.0.0.1:8000 --users 50 --iterations 20 --output scenario.json
+    python -m benchmarks.scenario --base-url http://127.0.0.1:8000 --baseline scenario.json   # thoát mã 1 nếu chậm đi
+
+Người dùng ảo thứ n đăng nhập bằng tài khoản giáo viên thứ n do seed_data tạo (hoặc --username cho tất cả).
+Mỗi lượt đặt 1 khung giờ riêng nên không bị trùng: mọi lượt đều thật sự ghi vào DB rồi được duyệt.
+/api/bookings/create trả về booking_id để admin duyệt đúng lịch vừa đặt.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from benchmarks import report as bench_report
+
+STEPS = ("login", "dashboard", "book", "approve")
+
+
+async def api_call(client, path, payload):
+    """POST JSON, trả về body nếu status == success, ngược lại None."""
+    r = await client.post(path, json=payload)
+    body = r.json() if r.status_code == 200 else {}
+    return body if body.get("status") == "success" else None
+
+
+async def page_ok(client, path):
+    return (await client.get(path)).status_code == 200
+
+
+async def login(client, username, password):
+    return await api_call(client, "/api/login", {"username": username, "password": password}) is not None
+
+
+def teacher_accounts(args):
+    """Lấy tên đăng nhập giáo viên của seed_data từ DB, tránh phải gọi API quản trị."""
+    if args.username: return [args.username] * args.users
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(args.database_url)
+    with engine.connect() as conn:
+        names = list(conn.scalars(text(
+            "SELECT username FROM users WHERE role = 'teacher' AND username LIKE 'bench%' ORDER BY id LIMIT :n"), {"n": args.users}))
+    engine.dispose()
+    if not names: raise SystemExit("Chưa có giáo viên giả: chạy python -m benchmarks.seed_data trước, hoặc dùng --username")
+    return [names[i % len(names)] for i in range(args.users)]
+
+
+async def run(args):
+    room_ids = [int(x) for x in args.room_ids.split(",")]
+    # Mỗi lần chạy lấy 1 vùng ngày ngẫu nhiên trong tương lai xa để lịch của các lần chạy trước không gây trùng
+    base = datetime.fromisoformat(args.start_date) if args.start_date else datetime(2040, 1, 1) + timedelta(days=random.randrange(36500))
+    accounts = teacher_accounts(args)
+    samples = {step: [] for step in STEPS}
+    errors = {step: 0 for step in STEPS}
+    limits = httpx.Limits(max_connections=args.users + 1)
+
+    async def timed(step, request):
+        t0 = time.perf_counter()
+        try: ok = await request
+        except httpx.HTTPError: ok = False
+        samples[step].append(time.perf_counter() - t0)
+        if not ok: errors[step] += 1
+        return ok
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60, limits=limits) as admin:
+        if not await login(admin, args.admin_username, args.admin_password):
+            raise SystemExit(f"Không đăng nhập được bằng {args.admin_username}")
+
+        async def virtual_user(n):
+            async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+                for i in range(args.iterations):
+                    client.cookies.clear()
+                    if not await timed("login", login(client, accounts[n], args.password)): continue
+                    await timed("dashboard", page_ok(client, "/dashboard"))
+                    # Khung giờ riêng cho từng (người dùng, lượt): không trùng với ai
+                    slot = base + timedelta(hours=n * args.iterations + i)
+                    payload = {"room_id": room_ids[n % len(room_ids)], "start_time": slot.isoformat() + ".000Z", "duration_display": "1 Giờ"}
+                    created = {}
+
+                    async def book():
+                        created.update(await api_call(client, "/api/bookings/create", payload) or {})
+                        return "booking_id" in created
+                    if not await timed("book", book()): continue
+
+                    async def approve():
+                        return await api_call(admin, "/api/bookings/approve", {"booking_id": created["booking_id"]}) is not None
+                    await timed("approve", approve())
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(virtual_user(n) for n in range(args.users)))
+        wall = time.perf_counter() - t0
+
+    report = bench_report.new_report("scenario", base_url=args.base_url, users=args.users, iterations=args.iterations, label=args.label)
+    for step in STEPS:
+        report["results"][step] = {**bench_report.summarize(samples[step], wall), "errors": errors[step]}
+    total = sum(len(v) for v in samples.values())
+    report["summary"] = {
+        "wall_seconds": round(wall, 3), "requests": total, "throughput_rps": round(total / wall, 1),
+        "completed_scenarios": len(samples["approve"]) - errors["approve"],
+        "scenarios_per_sec": round((len(samples["approve"]) - errors["approve"]) / wall, 1),
+        "errors": sum(errors.values()),
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///./bench.db"), help="Để lấy danh sách giáo viên giả")
+    parser.add_argument("--username", help="Mọi người dùng ảo dùng chung 1 tài khoản thay vì giáo viên giả")
+    parser.add_argument("--password", default="123")
+    parser.add_argument("--admin-username", default="admin")
+    parser.add_argument("--admin-password", default="123")
+    parser.add_argument("--room-ids", default="1,2,3")
+    parser.add_argument("--start-date", help="Lịch của kịch bản bắt đầu từ đây (mặc định: 1 ngày ngẫu nhiên sau 2040)")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--label", default="")
+    bench_report.add_arguments(parser)
+    args = parser.parse_args()
+    sys.exit(bench_report.finish(asyncio.run(run(args)), args))
+
+
+if __name__ == "__main__":
+    main()
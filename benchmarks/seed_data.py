@@ -0,0 +1,138 @@
+"""Sinh dữ liệu giả cho đo hiệu năng: users, classrooms, bookings ở quy mô tùy chọn (tới hàng triệu lịch đặt).
+
+    python -m benchmarks.seed_data --database-url sqlite:///./bench.db --users 2000 --rooms 100 --bookings 1000000
+
+Lịch đặt không trùng nhau trong cùng phòng, nằm trong giờ học 07:00 - 21:00 (giờ VN), thời lượng dạng "1 Giờ 30 Phút"
+như client gửi lên. Người dùng giả có tên đăng nhập bench0000001..., mật khẩu --password. Chạy lại sẽ thêm tiếp, không xóa.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Giờ VN 07:00 - 21:00 đổi sang UTC (giờ lưu trong DB)
+DAY_START_UTC = 0
+DAY_END_UTC = 14
+DURATIONS = [("30 Phút", 0.5), ("1 Giờ", 1), ("1 Giờ 30 Phút", 1.5), ("2 Giờ", 2), ("2 Giờ 30 Phút", 2.5), ("3 Giờ", 3), ("4 Giờ", 4)]
+DURATION_WEIGHTS = [10, 25, 20, 25, 8, 8, 4]
+GAPS = [0, 0, 0.5, 1, 1.5, 2, 3]  # Khoảng trống giữa 2 lịch liên tiếp của 1 phòng (giờ)
+EQUIPMENT = ["Máy chiếu", "TV", "Bảng thông minh", "Loa", "Máy chiếu,Loa", "Full"]
+HO = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng", "Bùi", "Đỗ"]
+DEM = ["Văn", "Thị", "Hữu", "Minh", "Ngọc", "Thanh", "Đức", "Thu", "Quốc", "Gia"]
+TEN = ["An", "Bình", "Chi", "Dũng", "Giang", "Hà", "Hải", "Hùng", "Lan", "Linh", "Long", "Mai", "Nam", "Phúc", "Quân", "Tâm", "Trang", "Tuấn", "Vy", "Yến"]
+
+
+def chunks(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch: yield batch
+
+
+def gen_users(rng, first, count, password, teacher_ratio):
+    for i in range(first, first + count):
+        yield {
+            "username": f"bench{i:07d}", "password": password, "email": f"bench{i:07d}@bench.edu.vn",
+            "phone": f"09{i:08d}"[-10:], "role": "teacher" if rng.random() < teacher_ratio else "student",
+            "full_name": f"{rng.choice(HO)} {rng.choice(DEM)} {rng.choice(TEN)}",
+        }
+
+
+def gen_rooms(rng, first, count):
+    for i in range(first, first + count):
+        yield {
+            "room_name": f"Phòng B{i:05d}", "capacity": rng.choice([20, 30, 40, 50, 60, 100, 200]),
+            "equipment": rng.choice(EQUIPMENT), "status": "Maintenance" if rng.random() < 0.03 else "Available",
+        }
+
+
+def gen_bookings(rng, count, rooms, bookers, start, pending_ratio):
+    """Chia đều lịch cho các phòng; mỗi phòng có con trỏ thời gian riêng chỉ tiến lên nên không bao giờ trùng."""
+    cursors = {room_id: start + timedelta(hours=DAY_START_UTC) for room_id in rooms}
+    for i in range(count):
+        room_id = rooms[i % len(rooms)]
+        label, hours = rng.choices(DURATIONS, DURATION_WEIGHTS)[0]
+        begin = cursors[room_id] + timedelta(hours=rng.choice(GAPS))
+        if begin + timedelta(hours=hours) > begin.replace(hour=DAY_END_UTC, minute=0):  # Hết giờ học -> sáng hôm sau
+            begin = begin.replace(hour=DAY_START_UTC, minute=0) + timedelta(days=1)
+        end = begin + timedelta(hours=hours)
+        cursors[room_id] = end
+        user_id, name = rng.choice(bookers)
+        yield {
+            "room_id": room_id, "user_id": user_id, "booker_name": name,
+            "start_time": begin.isoformat(timespec="milliseconds") + "Z", "duration_hours": label,
+            "status": "Pending" if rng.random() < pending_ratio else "Confirmed",
+            "start_at": begin, "end_at": end,
+        }
+
+
+def insert_rows(engine, insert, table, rows, chunk_size, progress=None):
+    total, t0 = 0, time.perf_counter()
+    for batch in chunks(rows, chunk_size):
+        with engine.begin() as conn: conn.execute(insert(table), batch)  # executemany theo lô, 1 transaction mỗi lô
+        total += len(batch)
+        if progress and total % (chunk_size * 10) == 0:
+            print(f"  {progress}: {total:,} dòng ({total / (time.perf_counter() - t0):,.0f} dòng/s)", file=sys.stderr)
+    return total, time.perf_counter() - t0
+
+
+def run(args):
+    os.environ["DATABASE_URL"] = args.database_url  # app đọc cấu hình lúc import
+    import app
+    from sqlalchemy import func, insert, select
+
+    rng = random.Random(args.seed)
+    app.startup_event()  # Tạo bảng/index/FTS + admin, 3 phòng mẫu giống lúc server khởi động
+    engine = app.engine
+    with engine.connect() as conn:
+        first_user = conn.scalar(select(func.count()).where(app.User.username.like("bench%"))) + 1
+        first_room = conn.scalar(select(func.count()).where(app.Classroom.room_name.like("Phòng B%"))) + 1
+
+    report = {"database_url": args.database_url, "seed": args.seed}
+    n, secs = insert_rows(engine, insert, app.User.__table__, gen_users(rng, first_user, args.users, args.password, args.teacher_ratio), args.chunk_size)
+    report["users"] = {"inserted": n, "seconds": round(secs, 2)}
+    n, secs = insert_rows(engine, insert, app.Classroom.__table__, gen_rooms(rng, first_room, args.rooms), args.chunk_size)
+    report["rooms"] = {"inserted": n, "seconds": round(secs, 2)}
+
+    with engine.connect() as conn:
+        rooms = list(conn.scalars(select(app.Classroom.id).order_by(app.Classroom.id)))
+        bookers = [(uid, name or username) for uid, name, username in conn.execute(
+            select(app.User.id, app.User.full_name, app.User.username).where(app.User.role.in_(["admin", "teacher"])))]
+        # Chạy thêm lần nữa: lịch mới bắt đầu sau lịch cuối cùng đang có để không trùng
+        last_end = conn.scalar(select(func.max(app.Booking.end_at)))
+    start = datetime.fromisoformat(args.start_date)
+    if last_end and last_end >= start: start = datetime(last_end.year, last_end.month, last_end.day) + timedelta(days=1)
+
+    rows = gen_bookings(rng, args.bookings, rooms, bookers, start, args.pending_ratio)
+    n, secs = insert_rows(engine, insert, app.Booking.__table__, rows, args.chunk_size, progress="bookings")
+    report["bookings"] = {"inserted": n, "seconds": round(secs, 2), "rows_per_sec": round(n / secs) if secs else None,
+                          "from": start.isoformat() + "Z"}
+    with engine.connect() as conn:
+        report["totals"] = {t.name: conn.scalar(select(func.count()).select_from(t))
+                            for t in (app.User.__table__, app.Classroom.__table__, app.Booking.__table__)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///./bench.db"))
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--bookings", type=int, default=100000)
+    parser.add_argument("--start-date", default="2030-01-01", help="Ngày bắt đầu của lịch giả (UTC)")
+    parser.add_argument("--password", default="123")
+    parser.add_argument("--teacher-ratio", type=float, default=0.3)
+    parser.add_argument("--pending-ratio", type=float, default=0.2)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42, help="Cùng seed + cùng tham số trên DB trống = cùng dữ liệu")
+    print(json.dumps(run(parser.parse_args()), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
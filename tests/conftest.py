@@ -0,0 +1,74 @@
+"""App chạy trên 1 DB SQLite tạm, gọi qua httpx.ASGITransport (không cần server, không cần dữ liệu của benchmarks).
+
+    pip install pytest
+    python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP = tempfile.mkdtemp(prefix="edumanager-test-")
+# app đọc cấu hình lúc import, thư mục templates/static tính từ thư mục hiện tại
+os.environ.update(DATABASE_URL=f"sqlite:///{TMP}/test.db", SESSION_SECRET="test", RATE_LIMIT="0", ARCHIVE_INTERVAL="0",
+                  JINJA_CACHE_DIR="", INIT_LOCK_FILE=os.path.join(TMP, "init.lock"))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+from sqlalchemy import event, insert  # noqa: E402
+
+import app as edu  # noqa: E402
+
+edu.startup_event()
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def client():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=edu.app), base_url="http://test") as c:
+        yield c
+
+
+_users = iter(range(1, 10 ** 9))
+
+
+def make_user(role="teacher", password="123"):
+    n = next(_users)
+    with edu.SessionLocal() as db:
+        user = edu.User(username=f"test{n}", password=password, role=role, full_name=f"Người dùng {n}", email=f"test{n}@test.edu.vn")
+        db.add(user)
+        db.commit()
+        return user.id, user.username
+
+
+def add_bookings(user_id, start, count, room_id=1, hours=1):
+    """Chèn thẳng count lịch 1 giờ liên tiếp cách nhau 2 giờ, bắt đầu từ start (UTC naive)."""
+    rows = [{"room_id": room_id, "user_id": user_id, "booker_name": "test", "status": "Confirmed", "duration_hours": f"{hours} Giờ",
+             "start_time": (start + timedelta(hours=2 * i)).isoformat(timespec="milliseconds") + "Z",
+             "start_at": start + timedelta(hours=2 * i), "end_at": start + timedelta(hours=2 * i + hours)} for i in range(count)]
+    with edu.engine.begin() as conn: conn.execute(insert(edu.Booking.__table__), rows)
+
+
+async def login(client, username, password="123"):
+    r = await client.post("/api/login", json={"username": username, "password": password})
+    assert r.json()["status"] == "success"
+
+
+@contextmanager
+def count_queries():
+    """Đếm câu SQL của đường async (request handler) trong khối with."""
+    executed = [0]
+
+    def count(*_): executed[0] += 1
+    sync_engine = edu.async_engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", count)
+    try: yield executed
+    finally: event.remove(sync_engine, "before_cursor_execute", count)
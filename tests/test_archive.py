@@ -0,0 +1,27 @@
+"""Lưu trữ lịch: id của lịch mới không được trùng id đã nằm trong bookings_archive."""
+import pytest
+
+from conftest import edu, login
+
+pytestmark = pytest.mark.anyio
+
+
+async def book(client, start_time):
+    r = await client.post("/api/bookings/create", json={"room_id": 1, "start_time": start_time, "duration_display": "1 Giờ"})
+    body = r.json()
+    assert body["status"] == "success", body
+    return body["booking_id"]
+
+
+async def test_archived_ids_are_not_reused(client):
+    await login(client, "admin")
+    # Lịch có id lớn nhất được lưu trữ -> SQLite không AUTOINCREMENT sẽ cấp lại đúng id đó cho lịch kế tiếp
+    first = await book(client, "2020-03-02T01:00:00.000Z")
+    await edu.booking_archiver.run_once()
+    second = await book(client, "2020-03-02T03:00:00.000Z")
+    assert second > first
+    await edu.booking_archiver.run_once()  # Trùng id thì lỗi UNIQUE ở bookings_archive
+
+    r = await client.get("/api/bookings", params={"from": "2020-03-02T00:00:00.000Z", "to": "2020-03-03T00:00:00.000Z"})
+    ids = [b["id"] for b in r.json()["bookings"]]
+    assert sorted(ids) == [first, second]
@@ -0,0 +1,52 @@
+"""Check trùng lịch: cận dưới start_at > start - MAX_BOOKING_HOURS vẫn đúng, và index quét khoảng bị chặn cả 2 phía."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from conftest import add_bookings, edu, login, make_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def book(client, start_time, duration="1 Giờ", room_id=2):
+    r = await client.post("/api/bookings/create", json={"room_id": room_id, "start_time": start_time, "duration_display": duration})
+    return r.json()
+
+
+async def test_longest_booking_still_conflicts(client):
+    await login(client, "admin")
+    assert (await book(client, "2033-05-01T00:00:00.000Z", f"{edu.MAX_BOOKING_HOURS} Giờ"))["status"] == "success"
+    # Bắt đầu 23 giờ sau lịch dài nhất: vẫn nằm trong lịch đó
+    assert (await book(client, "2033-05-01T23:00:00.000Z"))["status"] == "error"
+    # Bắt đầu đúng lúc lịch đó kết thúc: không trùng
+    assert (await book(client, "2033-05-02T00:00:00.000Z"))["status"] == "success"
+
+
+async def test_duration_out_of_range_is_rejected(client):
+    await login(client, "admin")
+    for duration in ("-2", "0", "500", f"{edu.MAX_BOOKING_HOURS + 1} Giờ"):
+        assert (await book(client, "2033-06-01T00:00:00.000Z", duration))["status"] == "error", duration
+
+
+def test_overlap_query_is_bounded_on_both_sides():
+    t = edu.Booking.__table__
+    start = datetime(2033, 1, 1)
+    q = select(t.c.id).where(t.c.room_id == 1, *edu.overlaps(t, start, start + timedelta(hours=1)))
+    compiled = q.compile(dialect=edu.engine.dialect)
+    with edu.engine.connect() as conn:
+        plan = " ".join(str(row[-1]) for row in conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + str(compiled), tuple(compiled.params[k] for k in compiled.positiontup)))
+    assert "start_at>? AND start_at<?" in plan, plan
+
+
+def test_legacy_long_bookings_are_clamped():
+    user_id, _ = make_user()
+    start = datetime(2034, 1, 1)
+    add_bookings(user_id, start, 1, room_id=3)
+    t = edu.Booking.__table__
+    with edu.engine.begin() as conn:
+        conn.execute(update(t).where(t.c.user_id == user_id).values(end_at=start + timedelta(days=21)))
+    edu.clamp_long_bookings()
+    with edu.engine.connect() as conn:
+        assert conn.scalar(select(t.c.end_at).where(t.c.user_id == user_id)) == start + timedelta(hours=edu.MAX_BOOKING_HOURS)
@@ -0,0 +1,23 @@
+"""Xuất CSV: giá trị người dùng tự nhập không được chạy như công thức khi mở bằng Excel."""
+import csv
+import io
+from datetime import datetime
+
+import pytest
+from sqlalchemy import update
+
+from conftest import add_bookings, edu, login, make_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_csv_export_neutralizes_formulas(client):
+    user_id, _ = make_user()
+    add_bookings(user_id, datetime(2035, 1, 1), 1)
+    t = edu.Booking.__table__
+    with edu.engine.begin() as conn:
+        conn.execute(update(t).where(t.c.user_id == user_id).values(booker_name='=HYPERLINK("http://x","y")'))
+    await login(client, "admin")
+    r = await client.get("/api/export/bookings.csv", params={"from": "2035-01-01T00:00:00.000Z", "to": "2035-01-02T00:00:00.000Z"})
+    rows = list(csv.DictReader(io.StringIO(r.text.lstrip("\ufeff"))))
+    assert [row["booker_name"] for row in rows] == ['\'=HYPERLINK("http://x","y")']
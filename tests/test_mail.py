@@ -0,0 +1,49 @@
+"""Hàng đợi email: 1 địa chỉ bị từ chối hẳn không được làm rơi cả lô, lỗi kết nối thì thử lại."""
+import smtplib
+
+import pytest
+
+from conftest import edu
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeSMTP:
+    def __init__(self, refuse=(), disconnect_once=False):
+        self.refuse = set(refuse)
+        self.disconnect_once = disconnect_once
+        self.delivered = []
+
+    def sendmail(self, sender, receiver, body):
+        if self.disconnect_once:
+            self.disconnect_once = False
+            raise smtplib.SMTPServerDisconnected("mất kết nối")
+        if receiver in self.refuse: raise smtplib.SMTPRecipientsRefused({receiver: (550, b"No such user")})
+        self.delivered.append(receiver)
+
+    def quit(self): pass
+
+    def close(self): pass
+
+
+def dispatcher(monkeypatch, server):
+    d = edu.MailDispatcher(backoff=0)
+    monkeypatch.setattr(d, "_connect", lambda: server)
+    return d
+
+
+def batch(*receivers):
+    return [(r, edu.MIMEText("OTP")) for r in receivers]
+
+
+async def test_refused_recipient_does_not_sink_batch(monkeypatch):
+    server = FakeSMTP(refuse={"bad@x"})
+    conn = await dispatcher(monkeypatch, server)._deliver(None, batch("bad@x", "alice@x", "bob@x"))
+    assert server.delivered == ["alice@x", "bob@x"]
+    assert conn is server  # Giữ kết nối cho lô sau
+
+
+async def test_transient_error_retries_rest_of_batch(monkeypatch):
+    server = FakeSMTP(disconnect_once=True)
+    await dispatcher(monkeypatch, server)._deliver(None, batch("alice@x", "bob@x"))
+    assert server.delivered == ["alice@x", "bob@x"]
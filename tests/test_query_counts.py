@@ -0,0 +1,31 @@
+"""Số câu SQL của 1 lần render /dashboard và /profile không được tăng theo số lịch của người dùng (chặn N+1)."""
+from datetime import datetime
+
+import pytest
+
+from conftest import add_bookings, count_queries, edu, login, make_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def render_queries(client, path):
+    # Bỏ mọi cache trong bộ nhớ để đo đúng đường nạp từ DB (DashboardStats._load, tra User)
+    edu.dashboard_stats.loaded_at = None
+    edu.user_cache.data.clear()
+    with count_queries() as executed:
+        r = await client.get(path)
+    assert r.status_code == 200
+    return executed[0]
+
+
+@pytest.mark.parametrize("path", ["/dashboard", "/profile"])
+async def test_render_query_count_is_fixed(client, path):
+    user_id, username = make_user()
+    await login(client, username)
+    start = datetime(2031, 1, 1)
+    add_bookings(user_id, start, 1)
+    one = await render_queries(client, path)
+    add_bookings(user_id, datetime(2032, 1, 1), 49)
+    many = await render_queries(client, path)
+    assert one > 0
+    assert one == many, f"{path}: {one} câu SQL với 1 lịch, {many} câu với 50 lịch"
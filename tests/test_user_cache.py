@@ -0,0 +1,35 @@
+"""Cache User: đổi/xóa user phát sự kiện "user" để mọi worker bỏ bản cache cũ."""
+from datetime import datetime
+
+import httpx
+import pytest
+
+from conftest import edu, login, make_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_user_event_evicts_cache_without_reaching_clients(client):
+    user_id, username = make_user()
+    await login(client, username)
+    assert (await client.get("/dashboard")).status_code == 200
+    assert edu.user_cache.get(user_id) is not None
+
+    sub = edu.booking_events.subscribe(None, datetime(2000, 1, 1), datetime(2100, 1, 1))
+    try:
+        edu.booking_events._deliver(edu.user_changed_event(user_id))  # Như sự kiện từ worker khác qua Redis
+        assert edu.user_cache.get(user_id) is None
+        assert sub.queue.empty()
+    finally:
+        edu.booking_events.unsubscribe(sub)
+
+
+async def test_demoted_user_loses_access(client):
+    user_id, username = make_user(role="admin")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=edu.app), base_url="http://test") as demoted:
+        await login(demoted, username)
+        assert (await demoted.get("/api/users")).status_code == 200
+        await login(client, "admin")
+        r = await client.post("/api/users/update", json={"user_id": user_id, "role": "teacher", "email": f"{username}@test.edu.vn"})
+        assert r.json()["status"] == "success"
+        assert (await demoted.get("/api/users")).status_code == 403